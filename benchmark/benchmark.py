@@ -0,0 +1,279 @@
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from stress import write_sphere, write_layers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LESSONS = ["lesson2", "lesson3"]
+MODELS = ["box", "monkey", "shapes"]
+STRESS = [10000, 100000, 1000000]
+# layer counts of the generated overdraw scenes, where deferred shading pays off
+OVERDRAW = [16]
+RESOLUTIONS = [(320, 240), (800, 600), (1920, 1080)]
+# the lesson2 loader only reads the first node with 16 bit signed indices,
+# and fills one pixel at a time, so it only gets the small cases
+LESSON2_MODELS = ["box", "monkey"]
+LESSON2_RESOLUTIONS = [(320, 240)]
+# a stage regresses when it is slower than the baseline by both of these
+TOLERANCE = 0.25
+# fill engines of lesson3, the first one is the default
+FILLS = ["edges", "scanline"]
+# lesson3 antialiasing modes, each reported against the 1x render of the same case
+ANTIALIAS = ["none", "msaa", "ssaa"]
+AA_SAMPLES = 4
+# lesson3 shading passes, each deferred case is reported against the forward one
+PASSES = ["forward", "deferred"]
+SHADINGS = ["unlit", "lambert", "blinn_phong", "pbr"]
+MIN_DELTA = 0.005
+
+def run_case(lesson: str, model: str, width: int, height: int, repeat: int, memory: bool, fill: str, antialias: str = "none", samples: int = AA_SAMPLES,
+        shading: str = SHADINGS[0], shading_pass: str = PASSES[0]) -> dict:
+    # runs inside the lesson folder, so its modules import under their own names
+    sys.path.insert(0, os.path.join(ROOT, lesson))
+    os.chdir(os.path.join(ROOT, lesson))
+    from camera import Camera
+    from rasterizer import Rasterizer
+    timer = stage_timer(lesson)
+
+    camera = Camera()
+    camera.set(position=[1, 2, 3], look_at=[0, 0, 0], up=[0, 1, 0], fovy=45, near=1)
+    if memory:
+        tracemalloc.start()
+    with timer.stage("load"):
+        rasterizer = Rasterizer(width, height, height // 3, camera, model)
+    if lesson != "lesson2":
+        rasterizer.fill = fill
+        rasterizer.shading = shading
+        rasterizer.deferred = shading_pass == "deferred"
+        if antialias != "none":
+            rasterizer.set_antialias(antialias, samples)
+
+    frames = []
+    for _ in range(repeat):
+        clear_buffers(lesson, rasterizer)
+        start = time.perf_counter()
+        rasterizer.draw_primitives()
+        frame = {"draw": time.perf_counter() - start}
+        frame.update(rasterizer.timer.report() if lesson != "lesson2" else timer.report())
+        frames.append(frame)
+        if lesson == "lesson2":
+            timer.stages = {"load": timer.stages["load"]}
+    load = timer.stages["load"]
+
+    # keep the fastest frame, the others mostly measure noise
+    frame = min(frames, key=lambda f: f["draw"])
+    stages = {"load": load, **frame["stages"]}
+    counters = frame["counters"]
+    triangles = counters.get("triangles", 0)
+    fragments = counters.get("fragments")
+    for name, stage in stages.items():
+        if name in ("transform", "cull"):
+            stage["triangles_per_sec"] = triangles / stage["time"] if stage["time"] else None
+        if name in ("rasterize", "depth", "shade") and fragments != None:
+            stage["fragments_per_sec"] = fragments / stage["time"] if stage["time"] else None
+    buffers = rasterizer.report_buffers() if lesson != "lesson2" else {}
+    return {
+        "lesson": lesson,
+        "model": os.path.basename(model),
+        "resolution": [width, height],
+        "fill": fill if lesson != "lesson2" else None,
+        "antialias": antialias if antialias != "none" else None,
+        "samples": buffers.get("samples", 1),
+        "shading": shading if lesson != "lesson2" else None,
+        "pass": shading_pass if lesson != "lesson2" else None,
+        "overdraw": rasterizer.report_overdraw()["overdraw"] if lesson != "lesson2" else None,
+        "buffer_bytes": sum(v for name, v in buffers.items() if name != "samples"),
+        "draw": frame["draw"],
+        "triangles": triangles,
+        "fragments": fragments,
+        "triangles_per_sec": triangles / frame["draw"] if frame["draw"] else None,
+        "fragments_per_sec": fragments / frame["draw"] if fragments and frame["draw"] else None,
+        "stages": stages,
+    }
+
+def stage_timer(lesson: str):
+    # lesson3 times its own stages, lesson2 gets its methods wrapped from outside
+    # with the lesson3 timer, loaded by path so no other lesson3 module leaks in
+    spec = importlib.util.spec_from_file_location("stage_timer", os.path.join(ROOT, "lesson3", "stage_timer.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    timer = module.StageTimer()
+    if lesson != "lesson2":
+        return timer
+
+    from rasterizer import Rasterizer
+    transform = Rasterizer.generate_pixel_positions
+    draw = Rasterizer.draw_triangles
+    def generate_pixel_positions(self, positions):
+        with timer.stage("transform"):
+            result = transform(self, positions)
+        return result
+    def draw_triangles(self, positions, indices):
+        timer.count("triangles", len(indices) // 3)
+        with timer.stage("rasterize"):
+            return draw(self, positions, indices)
+    Rasterizer.generate_pixel_positions = generate_pixel_positions
+    Rasterizer.draw_triangles = draw_triangles
+    return timer
+
+def clear_buffers(lesson: str, rasterizer) -> None:
+    if lesson == "lesson2":
+        rasterizer.rgbs[:] = 0
+        rasterizer.depth_map[:] = 1000
+    else:
+        rasterizer.color_map[:] = 0
+        rasterizer.depth_manager.depth_map[:] = float("-inf")
+
+def cases(lessons: list, models: list, stress: list, resolutions: list, fills: list, antialias: list, passes: list, overdraw: list = []) -> list:
+    result = []
+    for lesson in lessons:
+        for model in models + stress + ["layers_%d" % n for n in overdraw]:
+            if lesson == "lesson2" and model not in LESSON2_MODELS:
+                continue
+            for width, height in resolutions:
+                if lesson == "lesson2" and (width, height) not in LESSON2_RESOLUTIONS:
+                    continue
+                # lesson2 has only one fill, no antialiasing and no deferred pass
+                for fill in fills if lesson != "lesson2" else fills[:1]:
+                    for mode in antialias if lesson != "lesson2" else ["none"]:
+                        for shading_pass in passes if lesson != "lesson2" else PASSES[:1]:
+                            result.append((lesson, model, width, height, fill, mode, shading_pass))
+    return result
+
+def model_path(model) -> str:
+    if isinstance(model, int):
+        return write_sphere(model)
+    if model.startswith("layers_"):
+        return write_layers(int(model[len("layers_"):]))
+    return os.path.join(ROOT, "lesson3", model + ".gltf")
+
+def case_key(result: dict) -> str:
+    key = "%s/%s/%dx%d" % (result["lesson"], result["model"], *result["resolution"])
+    if result.get("fill") not in (None, FILLS[0]):
+        key += "/" + result["fill"]
+    if result.get("antialias"):
+        key += "/%s%d" % (result["antialias"], result["samples"])
+    if result.get("shading") not in (None, SHADINGS[0]):
+        key += "/" + result["shading"]
+    if result.get("pass") not in (None, PASSES[0]):
+        key += "/" + result["pass"]
+    return key
+
+def antialias_overhead(results: list) -> list:
+    # draw time and frame buffer memory of every antialiased case over its 1x render
+    plain = {case_key(r): r for r in results if not r.get("antialias")}
+    lines = []
+    for result in results:
+        base = plain.get(case_key({**result, "antialias": None}))
+        if result.get("antialias") and base != None:
+            lines.append("%-42s draw x%.2f  buffers x%.2f (%.1f MB)" % (case_key(result), result["draw"] / base["draw"],
+                result["buffer_bytes"] / base["buffer_bytes"], result["buffer_bytes"] / (1 << 20)))
+    return lines
+
+def deferred_speedup(results: list) -> list:
+    # draw time of every deferred case against the forward render of the same case, with its overdraw
+    forward = {case_key(r): r for r in results if r.get("pass") != "deferred"}
+    lines = []
+    for result in results:
+        base = forward.get(case_key({**result, "pass": None}))
+        if result.get("pass") == "deferred" and base != None:
+            lines.append("%-48s overdraw %5.2f  forward %.4fs  deferred %.4fs  x%.2f" % (case_key(result), base["overdraw"],
+                base["draw"], result["draw"], base["draw"] / result["draw"]))
+    return lines
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    # every stage that got slower than the stored baseline
+    regressions = []
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old == None:
+            continue
+        timings = {"draw": (result["draw"], old["draw"])}
+        for name, stage in result["stages"].items():
+            if name in old["stages"]:
+                timings[name] = (stage["time"], old["stages"][name]["time"])
+        for name, (now, before) in timings.items():
+            if now > before * (1 + tolerance) and now - before > MIN_DELTA:
+                regressions.append("%s %s: %.4fs -> %.4fs (%+.0f%%)" % (case_key(result), name, before, now, 100 * (now / before - 1)))
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="time every stage of the rasterizers")
+    parser.add_argument("--lessons", nargs="+", default=LESSONS)
+    parser.add_argument("--models", nargs="*", default=MODELS)
+    parser.add_argument("--stress", nargs="*", type=int, default=STRESS, help="triangle counts of generated spheres")
+    parser.add_argument("--overdraw", nargs="*", type=int, default=OVERDRAW, help="layer counts of generated overdraw scenes")
+    parser.add_argument("--resolutions", nargs="*", default=["%dx%d" % r for r in RESOLUTIONS])
+    parser.add_argument("--fills", nargs="+", default=FILLS[:1], choices=FILLS, help="lesson3 fill engines to compare")
+    parser.add_argument("--antialias", nargs="+", default=ANTIALIAS[:1], choices=ANTIALIAS, help="lesson3 antialiasing modes to compare, with none as 1x")
+    parser.add_argument("--samples", type=int, default=AA_SAMPLES, help="samples per pixel of the antialiased modes, a square number")
+    parser.add_argument("--shading", default=SHADINGS[0], choices=SHADINGS, help="lesson3 shading model of every case")
+    parser.add_argument("--passes", nargs="+", default=PASSES[:1], choices=PASSES, help="lesson3 shading passes to compare, with forward as the base")
+    parser.add_argument("--repeat", type=int, default=3, help="frames per case, the fastest is kept")
+    parser.add_argument("--memory", action="store_true", help="trace peak memory per stage (slower)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="fail when a stage is slower than in this results file")
+    parser.add_argument("--save-baseline", help="also write the results as a baseline file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        lesson, model, width, height, fill, antialias, shading_pass = json.loads(args.worker)
+        print(json.dumps(run_case(lesson, model, width, height, args.repeat, args.memory, fill, antialias, args.samples, args.shading, shading_pass)))
+        return
+
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions]
+    results = []
+    for lesson, model, width, height, fill, antialias, shading_pass in cases(args.lessons, args.models, args.stress, resolutions, args.fills, args.antialias, args.passes, args.overdraw):
+        # one process per case, so every lesson imports its own modules and memory starts clean
+        job = json.dumps([lesson, model_path(model), width, height, fill, antialias, shading_pass])
+        command = [sys.executable, os.path.abspath(__file__), "--worker", job, "--repeat", str(args.repeat), "--samples", str(args.samples),
+            "--shading", args.shading]
+        if args.memory:
+            command.append("--memory")
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print("FAILED %s %s %dx%d %s %s %s\n%s" % (lesson, model, width, height, fill, antialias, shading_pass, output.stderr), file=sys.stderr)
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print("%-48s draw %8.4fs  %10.0f tri/s  %s frag/s" % (case_key(result), result["draw"],
+            result["triangles_per_sec"] or 0, "%.0f" % result["fragments_per_sec"] if result["fragments_per_sec"] else "-"))
+
+    overhead = antialias_overhead(results)
+    if overhead:
+        print("\nantialiasing overhead against 1x")
+        for line in overhead:
+            print("  " + line)
+
+    speedup = deferred_speedup(results)
+    if speedup:
+        print("\ndeferred shading against forward")
+        for line in speedup:
+            print("  " + line)
+
+    report = {case_key(r): r for r in results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS", file=sys.stderr)
+            for line in regressions:
+                print("  " + line, file=sys.stderr)
+            sys.exit(1)
+        print("\nno regressions against", args.baseline)
+
+if __name__ == "__main__":
+    main()
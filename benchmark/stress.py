@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+STRESS_DIR = os.path.join(tempfile.gettempdir(), "rasterizer_stress")
+
+def make_sphere(triangles: int) -> tuple:
+    # subdivided cube pushed onto the unit sphere, 6 faces * n * n quads * 2 triangles
+    n = max(1, int(round(np.sqrt(triangles / 12))))
+    t = np.linspace(-1, 1, n + 1)
+    u, v = np.meshgrid(t, t, indexing="ij")
+    u, v, one = u.ravel(), v.ravel(), np.ones((n + 1) ** 2)
+    faces = [
+        (one, v, -u), (-one, v, u), (u, one, -v),
+        (u, -one, v), (u, v, one), (-u, v, -one),
+    ]
+
+    # two counter-clockwise triangles per grid quad, seen from outside
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    a = (i * (n + 1) + j).ravel()
+    b, c, d = a + n + 1, a + n + 2, a + 1
+    quad = np.stack([a, b, c, a, c, d], axis=1).reshape(-1, 3)
+
+    positions, indices = [], []
+    for k, face in enumerate(faces):
+        positions.append(np.stack(face, axis=1))
+        indices.append(quad + k * (n + 1) ** 2)
+    positions = np.concatenate(positions)
+    positions /= np.linalg.norm(positions, axis=1, keepdims=True)
+    uvs = np.stack([np.arctan2(positions[:, 2], positions[:, 0]) / (2 * np.pi) + 0.5,
+        np.arccos(np.clip(positions[:, 1], -1, 1)) / np.pi], axis=1)
+    return positions.astype(np.float32), uvs.astype(np.float32), np.concatenate(indices).ravel().astype(np.uint32)
+
+def write_sphere(triangles: int, folder: str = STRESS_DIR) -> str:
+    # write a sphere as a .gltf + .bin pair once and return the .gltf path
+    path = os.path.join(folder, f"sphere_{triangles}.gltf")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(folder, exist_ok=True)
+    positions, uvs, indices = make_sphere(triangles)
+    # on a unit sphere the normal is the position
+    blobs = [positions, positions, uvs, indices]
+    name = os.path.basename(path).replace(".gltf", ".bin")
+    with open(os.path.join(folder, name), "wb") as f:
+        for blob in blobs:
+            f.write(blob.tobytes())
+
+    views, offset = [], 0
+    for blob in blobs:
+        views.append({"buffer": 0, "byteOffset": offset, "byteLength": blob.nbytes})
+        offset += blob.nbytes
+    count = len(positions)
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "name": "Sphere"}],
+        "meshes": [{"name": "Sphere", "primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1, "TEXCOORD_0": 2}, "indices": 3}]}],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": count, "type": "VEC3", "min": [-1, -1, -1], "max": [1, 1, 1]},
+            {"bufferView": 1, "componentType": 5126, "count": count, "type": "VEC3"},
+            {"bufferView": 2, "componentType": 5126, "count": count, "type": "VEC2"},
+            {"bufferView": 3, "componentType": 5125, "count": len(indices), "type": "SCALAR"},
+        ],
+        "bufferViews": views,
+        "buffers": [{"byteLength": offset, "uri": name}],
+    }
+    with open(path, "w") as f:
+        json.dump(gltf, f)
+    return path
+
+def write_layers(layers: int, folder: str = STRESS_DIR) -> str:
+    # stacked quads facing the benchmark camera, far to near, each its own mesh so every
+    # layer is a separate draw: the worst case overdraw that deferred shading is made for
+    path = os.path.join(folder, f"layers_{layers}.gltf")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(folder, exist_ok=True)
+    toward = np.array([1, 2, 3], np.float64) / np.sqrt(14)
+    right = np.cross([0, 1, 0], toward)
+    right /= np.linalg.norm(right)
+    up = np.cross(toward, right)
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], np.float64)
+    quad = (corners[:, :1] * right + corners[:, 1:] * up) * 1.5
+    normals = np.repeat(toward[None], 4, axis=0).astype(np.float32)
+    uvs = ((corners + 1) / 2).astype(np.float32)
+    indices = np.array([0, 1, 2, 0, 2, 3], np.uint32)
+
+    name = os.path.basename(path).replace(".gltf", ".bin")
+    views, accessors, meshes, offset = [], [], [], 0
+    with open(os.path.join(folder, name), "wb") as f:
+        for k, t in enumerate(np.linspace(-1, 1, layers)):
+            positions = (quad + t * toward).astype(np.float32)
+            for blob, kind, component in ((positions, "VEC3", 5126), (normals, "VEC3", 5126), (uvs, "VEC2", 5126), (indices, "SCALAR", 5125)):
+                f.write(blob.tobytes())
+                views.append({"buffer": 0, "byteOffset": offset, "byteLength": blob.nbytes})
+                accessor = {"bufferView": len(views) - 1, "componentType": component, "count": len(blob), "type": kind}
+                if blob is positions:
+                    accessor.update(min=positions.min(axis=0).tolist(), max=positions.max(axis=0).tolist())
+                accessors.append(accessor)
+                offset += blob.nbytes
+            a = 4 * k
+            meshes.append({"name": "Layer%d" % k, "primitives": [{"attributes": {"POSITION": a, "NORMAL": a + 1, "TEXCOORD_0": a + 2}, "indices": a + 3}]})
+
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(layers))}],
+        "nodes": [{"mesh": k, "name": "Layer%d" % k} for k in range(layers)],
+        "meshes": meshes,
+        "accessors": accessors,
+        "bufferViews": views,
+        "buffers": [{"byteLength": offset, "uri": name}],
+    }
+    with open(path, "w") as f:
+        json.dump(gltf, f)
+    return path
@@ -22,34 +22,30 @@ class Rasterizer:
 
     def draw_primitives(self):
         for primitive in self.primitives:
-            positions = self.generate_pixel_positions(primitive["vertices"])
+            positions = self.generate_pixel_positions(np.asarray(primitive["vertices"]))
             indices = primitive["indices"]
             self.draw_triangles(positions, indices)
 
         return Image.fromarray(self.rgbs, 'RGB')
 
     def generate_pixel_positions(self, positions):
-        pixel_positions = []
+        # transform all the vertices at once, [x, y, z] -> [x, y, z, 1] -> [x', y', z', -z']
         projection_matrix = self.camera.get_perspective().transpose()
-        for pos in positions:
-            pos.append(1)   # [x, y, z] -> [x, y, z, 1]
-            camera_pos = np.matmul(pos, projection_matrix)
+        homogeneous = np.hstack([positions, np.ones((len(positions), 1))])
+        camera_pos = homogeneous @ projection_matrix
 
-            # fit points to canvas
-            x, y = camera_pos[0]/camera_pos[3], camera_pos[1]/camera_pos[3]
-            depth = camera_pos[2]
+        # fit points to canvas
+        x, y = camera_pos[:, 0]/camera_pos[:, 3], camera_pos[:, 1]/camera_pos[:, 3]
+        depth = camera_pos[:, 2]
 
-            px = (int)(x * self.scale + self.width/2)
-            py = (int)(-1 * y * self.scale + self.height/2)
-            pixel_positions.append((px, py, depth))
-
-        return pixel_positions
+        px = (x * self.scale + self.width/2).astype(np.int32)
+        py = (-1 * y * self.scale + self.height/2).astype(np.int32)
+        return px, py, depth
 
     def draw_triangles(self, positions, indices):
+        px, py, depth = positions
         for i in range(0, len(indices), 3):
-            a = positions[indices[i]]
-            b = positions[indices[i + 1]]
-            c = positions[indices[i + 2]]
+            a, b, c = [(px[j], py[j], depth[j]) for j in indices[i:i + 3]]
             #self.draw_line(a, b)
             #self.draw_line(b, c)
             #self.draw_line(c, a)
@@ -0,0 +1,133 @@
+import numpy as np
+from triangle import Mesh, Primitive
+
+# glTF sampler interpolations
+STEP = "STEP"
+LINEAR = "LINEAR"
+CUBICSPLINE = "CUBICSPLINE"
+
+class Sampler:
+    # keyframes of one animated property: (K,) times and (K, k) values,
+    # or (K, 3, k) [in tangent, value, out tangent] for cubic splines
+    def __init__(self, times: np.ndarray, values: np.ndarray, interpolation: str = LINEAR) -> None:
+        self.times = np.asarray(times, np.float64)
+        self.values = np.asarray(values, np.float64)
+        self.interpolation = interpolation
+
+    def sample(self, time: float, rotation: bool = False) -> np.ndarray:
+        # (k,) value at a time, held at the first and last keyframe; rotations are quaternions
+        times = self.times
+        keys = self.values[:, 1] if self.interpolation == CUBICSPLINE else self.values
+        if time <= times[0] or len(times) == 1:
+            return keys[0]
+        if time >= times[-1]:
+            return keys[-1]
+
+        i = np.searchsorted(times, time, "right") - 1
+        step = times[i + 1] - times[i]
+        s = (time - times[i]) / step
+        if self.interpolation == STEP:
+            return keys[i]
+        if self.interpolation == CUBICSPLINE:
+            # hermite spline through both values, tangents are scaled by the keyframe step
+            s2, s3 = s * s, s * s * s
+            value = (2*s3 - 3*s2 + 1) * keys[i] + (s3 - 2*s2 + s) * step * self.values[i, 2] \
+                + (-2*s3 + 3*s2) * keys[i + 1] + (s3 - s2) * step * self.values[i + 1, 0]
+            return value / np.linalg.norm(value) if rotation else value
+        if rotation:
+            return slerp(keys[i], keys[i + 1], s)
+        return keys[i] * (1 - s) + keys[i + 1] * s
+
+def slerp(a: np.ndarray, b: np.ndarray, s: float) -> np.ndarray:
+    # spherical interpolation of unit quaternions along the shorter arc
+    cos = np.dot(a, b)
+    if cos < 0:
+        b, cos = -b, -cos
+    if cos > 0.9995:
+        value = a * (1 - s) + b * s
+        return value / np.linalg.norm(value)
+    angle = np.arccos(cos)
+    return (np.sin((1 - s) * angle) * a + np.sin(s * angle) * b) / np.sin(angle)
+
+class Animation:
+    # glTF channels: (node, path, sampler) where path is translation, rotation, scale or weights
+    def __init__(self, name: str, channels: list) -> None:
+        self.name = name
+        self.channels = channels
+        self.duration = max((sampler.times[-1] for _, _, sampler in channels), default=0.0)
+
+    def apply(self, time: float) -> None:
+        # pose the nodes at a time in seconds, skins and morphs follow on the next frame
+        for node, path, sampler in self.channels:
+            value = sampler.sample(time, path == "rotation")
+            if path == "translation":
+                node.set_translation(value.tolist())
+            elif path == "rotation":
+                node.set_rotation(value.tolist())
+            elif path == "scale":
+                node.set_scale(value.tolist())
+            elif path == "weights" and isinstance(node, Mesh):
+                node.weights = value
+
+class Skin:
+    # joints are nodes of the scene, bound to the mesh by their (J, 4, 4) inverse bind matrices
+    def __init__(self, joints: list, inverse_binds: np.ndarray) -> None:
+        self.joints = joints
+        self.inverse_binds = inverse_binds
+
+    def joint_matrices(self, mesh: Mesh) -> np.ndarray:
+        # (J, 4, 4) matrices moving bind pose vertices to where the joints are now in world space;
+        # glTF ignores the transform of a skinned mesh node, so it is drawn with an identity model
+        # matrix and a zero scaled or otherwise singular node needs no inverse
+        return np.array([joint.get_matrix() for joint in self.joints]) @ self.inverse_binds
+
+def is_deformed(mesh: Mesh) -> bool:
+    return mesh.skin != None or any(len(p.targets) for p in mesh.primitives)
+
+def pose_mesh(mesh: Mesh) -> bool:
+    # update the posed primitives of a skinned or morphed mesh, whether they changed
+    if not is_deformed(mesh):
+        return False
+    weights = np.asarray(mesh.weights, np.float64)
+    joints = None if mesh.skin == None else mesh.skin.joint_matrices(mesh)
+    if mesh.posed != None and np.array_equal(weights, mesh.pose[0]) and (joints is None or np.array_equal(joints, mesh.pose[1])):
+        return False
+
+    if mesh.posed == None:
+        mesh.posed = [copy_primitive(p) for p in mesh.primitives]
+    for primitive, posed in zip(mesh.primitives, mesh.posed):
+        vertices, normals = morph(primitive, weights)
+        if joints is not None and len(primitive.joints):
+            vertices, normals = skin(vertices, normals, primitive.joints, primitive.skin_weights, joints)
+        posed.vertices = vertices
+        posed.normals = normals
+        posed.bounds = np.array([vertices.min(axis=0), vertices.max(axis=0)]) if len(vertices) else np.zeros((2, 3))
+    mesh.pose = (weights, joints)
+    return True
+
+def copy_primitive(primitive: Primitive) -> Primitive:
+    # shares everything but the vertices and normals the pose replaces
+    posed = Primitive()
+    posed.__dict__.update(primitive.__dict__)
+    return posed
+
+def morph(primitive: Primitive, weights: np.ndarray) -> tuple:
+    # rest pose plus one weighted sum of the (T, N, 3) target offsets with a weight
+    vertices, normals = primitive.vertices, primitive.normals
+    active = np.nonzero(weights[:len(primitive.targets)])[0]
+    if len(active) == 0:
+        return vertices, normals
+    vertices = vertices + np.tensordot(weights[active], primitive.targets[active], 1)
+    if len(primitive.target_normals) and len(normals):
+        normals = normals + np.tensordot(weights[active], primitive.target_normals[active], 1)
+    return vertices, normals
+
+def skin(vertices: np.ndarray, normals: np.ndarray, joints: np.ndarray, weights: np.ndarray, matrices: np.ndarray) -> tuple:
+    # linear blend skinning: each vertex goes through the weighted sum of its (4, 4) joint matrices,
+    # only their top (3, 4) rows are blended, as (1, 4) @ (4, 12) products batched over the vertices
+    rows = matrices[:, :3].reshape(len(matrices), 12)
+    blended = (weights[:, None, :] @ rows[joints]).reshape(-1, 3, 4)
+    vertices = (blended[:, :, :3] @ vertices[:, :, None])[:, :, 0] + blended[:, :, 3]
+    if len(normals):
+        normals = (blended[:, :, :3] @ normals[:, :, None])[:, :, 0]
+    return vertices, normals
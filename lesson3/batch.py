@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from camera import Camera
+from gltf_loader import GltfLoader
+from lighting import UNLIT, LAMBERT, BLINN_PHONG, PBR
+from mesh_cache import MeshCache
+from rasterizer import Rasterizer
+
+I_WIDTH = 800
+I_HEIGHT = 600
+I_SCALE = 200
+# decoded models every worker keeps in memory between jobs
+ASSET_BUDGET = 16
+# tries of a job whose worker died; nothing tells which job of a broken pool killed it,
+# so they all run again, each alone, and the one that kills its worker again is given up
+MAX_ATTEMPTS = 2
+DEFAULT_CAMERA = {"position": [1, 2, 3], "look_at": [0, 0, 0], "up": [0, 1, 0], "fovy": 45, "near": 1}
+
+# the asset cache of a worker process, made once by init_worker
+worker_state = {}
+
+def file_stamps(files: list) -> list:
+    # (path, mtime, size) of every file, None when one is gone
+    try:
+        stats = [os.stat(file) for file in files]
+    except OSError:
+        return None
+    return [(file, s.st_mtime_ns, s.st_size) for file, s in zip(files, stats)]
+
+class AssetCache:
+    # decoded meshes of the models rendered last, handed to Rasterizer in place of a loader; a model
+    # is decoded again when any file it was read from changed (the model, its buffers and images),
+    # through the on-disk cache when there is one
+    def __init__(self, budget: int = ASSET_BUDGET, cache: MeshCache = None) -> None:
+        self.budget = budget
+        self.cache = cache
+        self.entries = OrderedDict()
+        self.animations = []
+        self.hits = 0
+
+    def load(self, path: str) -> list:
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if entry != None and entry[0] != None and file_stamps([file for file, _, _ in entry[0]]) == entry[0]:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            _, meshes, self.animations = entry
+            return meshes
+
+        loader = self.cache if self.cache != None else GltfLoader()
+        meshes = loader.load(path)
+        self.animations = loader.animations
+        self.entries[key] = (file_stamps(loader.files), meshes, self.animations)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.budget:
+            self.entries.popitem(last=False)
+        return meshes
+
+def read_manifest(path: str) -> list:
+    # a json list of jobs or one json job per line; model and output paths are relative to the manifest
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        jobs = json.loads(text)
+    else:
+        jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    folder = os.path.dirname(os.path.abspath(path))
+    for i, job in enumerate(jobs):
+        job.setdefault("id", str(i))
+        for name in ("model", "output"):
+            if name in job:
+                job[name] = os.path.join(folder, job[name])
+    return jobs
+
+def init_worker(budget: int, use_cache: bool) -> None:
+    worker_state["assets"] = AssetCache(budget, MeshCache() if use_cache else None)
+
+def render_job(job: dict) -> dict:
+    # one log record, a failing model is reported instead of raised so the batch goes on
+    assets = worker_state["assets"]
+    record = {"id": job["id"], "model": job.get("model"), "output": job.get("output"), "pid": os.getpid()}
+    timings = {}
+    try:
+        size = job.get("size", [I_WIDTH, I_HEIGHT])
+        width, height = (int(v) for v in (size.split("x") if isinstance(size, str) else size))
+        camera = Camera()
+        camera.set(**{**DEFAULT_CAMERA, **job.get("camera", {})})
+        if camera.version == 0:
+            # set only prints what it refused, the job must not render with the default camera
+            raise ValueError("invalid camera " + json.dumps(job.get("camera", {})))
+
+        shading = job.get("shading", UNLIT)
+        if shading not in (UNLIT, LAMBERT, BLINN_PHONG, PBR):
+            raise ValueError("unknown shading " + str(shading))
+
+        start = time.perf_counter()
+        hits = assets.hits
+        # levels of detail are built while loading and stay with the meshes the worker keeps
+        rasterizer = Rasterizer(width, height, job.get("scale", I_SCALE * height // I_HEIGHT), camera, job["model"], assets, job.get("lod", False))
+        timings["load"] = time.perf_counter() - start
+        record["cached"] = assets.hits > hits
+        rasterizer.shading = shading
+        rasterizer.deferred = job.get("deferred", False)
+
+        start = time.perf_counter()
+        image = rasterizer.draw_primitives()
+        timings["draw"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        folder = os.path.dirname(job["output"])
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        image.save(job["output"])
+        timings["save"] = time.perf_counter() - start
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+        record["traceback"] = traceback.format_exc()
+    record["timings"] = timings
+    return record
+
+def done_jobs(log: str) -> set:
+    # ids a previous run of the same log rendered, so a resumed batch skips them
+    if not os.path.exists(log):
+        return set()
+    done = set()
+    with open(log) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+def run_batch(jobs: list, log: str, workers: int = None, budget: int = ASSET_BUDGET, use_cache: bool = False, resume: bool = False) -> dict:
+    # render every job on a pool of workers and append a record per job to the jsonl log as it
+    # finishes; when a worker dies the pool is started again and its jobs are tried again alone
+    if resume:
+        done = done_jobs(log)
+        jobs = [job for job in jobs if job["id"] not in done]
+    workers = workers or os.cpu_count() or 1
+    pending = list(reversed(jobs))
+    attempts = {}
+    summary = {"ok": 0, "failed": 0}
+
+    with open(log, "a") as f:
+        def write(record: dict) -> None:
+            summary[record["status"]] += 1
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+        while pending:
+            executor = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(budget, use_cache))
+            running = {}
+            broken = False
+            try:
+                while (pending or running) and not broken:
+                    # keep a few jobs queued per worker, a manifest of thousands is not submitted at once
+                    while pending and len(running) < 2 * workers:
+                        if attempts.get(pending[-1]["id"]) and running:
+                            break
+                        job = pending.pop()
+                        running[executor.submit(render_job, job)] = job
+                        if attempts.get(job["id"]):
+                            break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        try:
+                            record = future.result()
+                        except BrokenProcessPool:
+                            broken = True
+                            continue
+                        write(record)
+                        del running[future]
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+            for job in running.values():
+                attempts[job["id"]] = attempts.get(job["id"], 0) + 1
+                if attempts[job["id"]] < MAX_ATTEMPTS:
+                    pending.append(job)
+                else:
+                    write({"id": job["id"], "model": job.get("model"), "output": job.get("output"),
+                        "status": "failed", "error": "worker process died", "timings": {}})
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="render every job of a manifest, logging one json line per job")
+    parser.add_argument("manifest", help="json list or jsonl of jobs: model, output, camera, size, scale, shading, deferred, lod, id")
+    parser.add_argument("--log", default="batch_log.jsonl")
+    parser.add_argument("--workers", type=int, default=None, help="processes, one per cpu by default")
+    parser.add_argument("--budget", type=int, default=ASSET_BUDGET, help="decoded models each worker keeps")
+    parser.add_argument("--cache", action="store_true", help="load through the on-disk mesh cache, shared by every worker")
+    parser.add_argument("--resume", action="store_true", help="skip jobs the log already has as ok")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = run_batch(read_manifest(args.manifest), args.log, args.workers, args.budget, args.cache, args.resume)
+    print("%d ok, %d failed in %.1fs, log in %s" % (summary["ok"], summary["failed"], time.perf_counter() - start, args.log))
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,78 @@
+import base64
+import mmap
+import os
+import struct
+from urllib.parse import unquote
+from pygltflib import GLTF2
+
+# .glb header and chunk types
+GLB_MAGIC = b"glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+def load_document(path: str) -> tuple:
+    # the glTF json of a .gltf or .glb file, and the (offset, length) of a .glb's
+    # binary chunk inside the file, or None; the binary chunk itself is not read
+    with open(path, "rb") as f:
+        magic, _, length = struct.unpack("<4sII", f.read(12))
+        if magic != GLB_MAGIC:
+            f.seek(0)
+            return GLTF2.gltf_from_json(f.read().decode("utf-8")), None
+
+        gltf, binary = None, None
+        while f.tell() < length:
+            chunk_length, chunk_type = struct.unpack("<II", f.read(8))
+            if chunk_type == CHUNK_JSON:
+                gltf = GLTF2.gltf_from_json(f.read(chunk_length).decode("utf-8"))
+            else:
+                if chunk_type == CHUNK_BIN and binary == None:
+                    binary = (f.tell(), chunk_length)
+                f.seek(chunk_length, os.SEEK_CUR)
+    if gltf == None:
+        raise ValueError("no json chunk in " + path)
+    return gltf, binary
+
+class BufferManager:
+    # the bytes of every glTF buffer, each read the first time an accessor needs it:
+    # files and the binary chunk of a .glb are memory mapped, data uris decoded once,
+    # and bufferViews are handed out as memoryview slices so nothing is copied
+    def __init__(self, gltf: GLTF2, path: str, binary: tuple = None) -> None:
+        self.gltf = gltf
+        self.path = path
+        self.folder = os.path.dirname(path)
+        self.binary = binary
+        self.buffers = {}
+
+    def get(self, index: int) -> memoryview:
+        if index not in self.buffers:
+            self.buffers[index] = self.read(index)
+        return self.buffers[index]
+
+    def read(self, index: int) -> memoryview:
+        buffer = self.gltf.buffers[index]
+        if buffer.uri == None:
+            # only the first buffer of a .glb may leave out its uri, it is the binary chunk
+            if self.binary == None:
+                raise ValueError("buffer %d has no uri and %s has no binary chunk" % (index, self.path))
+            offset, length = self.binary
+            return self.map(self.path)[offset:offset + length]
+        if buffer.uri.startswith("data:"):
+            return memoryview(decode_data_uri(buffer.uri))
+        return self.map(os.path.join(self.folder, unquote(buffer.uri)))[:buffer.byteLength]
+
+    def map(self, path: str) -> memoryview:
+        with open(path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def view(self, index: int) -> memoryview:
+        # the bytes of a bufferView
+        view = self.gltf.bufferViews[index]
+        offset = view.byteOffset or 0
+        return self.get(view.buffer)[offset:offset + view.byteLength]
+
+def decode_data_uri(uri: str) -> bytes:
+    # data:[<mime type>][;base64],<data>
+    header, data = uri.split(",", 1)
+    if header.endswith(";base64"):
+        return base64.b64decode(data)
+    return unquote(data).encode("latin-1")
@@ -0,0 +1,124 @@
+import numpy as np
+
+# most items kept in one leaf
+LEAF_SIZE = 4
+
+def transform_bounds(bounds: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    # world space (2, 3) box around a (2, 3) local box moved by a 4x4 matrix,
+    # or (M, 2, 3) boxes for (M, 4, 4) matrices
+    corners = np.array(np.meshgrid(*bounds.T, indexing="ij")).reshape(3, -1).T
+    moved = corners @ np.swapaxes(matrix[..., :3, :3], -1, -2) + matrix[..., None, :3, 3]
+    return np.stack([moved.min(axis=-2), moved.max(axis=-2)], axis=-2)
+
+class BVH:
+    # bounding volume hierarchy over (M, 2, 3) boxes, stored as flat node arrays
+    # so every query handles a whole level of nodes at once
+    def __init__(self, bounds: np.ndarray) -> None:
+        bounds = np.asarray(bounds, np.float64).reshape(-1, 2, 3)
+        self.bounds = bounds
+        self.items = np.arange(len(bounds))
+        lows, highs, children, ranges = [], [], [], []
+
+        # split on the median centroid of the longest axis until the leaves are small
+        centers = bounds.mean(axis=1)
+        stack = [(0, len(bounds), -1, 0)]
+        while stack:
+            start, end, parent, side = stack.pop()
+            node = len(lows)
+            if parent >= 0:
+                children[parent][side] = node
+            items = self.items[start:end]
+            lows.append(bounds[items, 0].min(axis=0) if len(items) else np.zeros(3))
+            highs.append(bounds[items, 1].max(axis=0) if len(items) else np.zeros(3))
+            children.append([-1, -1])
+            ranges.append((start, end))
+            if end - start <= LEAF_SIZE:
+                continue
+
+            axis = np.argmax(np.ptp(centers[items], axis=0))
+            self.items[start:end] = items[np.argsort(centers[items, axis], kind="stable")]
+            middle = (start + end) // 2
+            stack.append((middle, end, node, 1))
+            stack.append((start, middle, node, 0))
+
+        self.low = np.array(lows)
+        self.high = np.array(highs)
+        self.children = np.array(children, int)
+        self.ranges = np.array(ranges, int)
+
+    def leaf_items(self, leaves: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.items[s:e] for s, e in self.ranges[leaves]] + [np.zeros(0, int)])
+
+    def query_frustum(self, planes: np.ndarray) -> np.ndarray:
+        # items whose box is not completely behind any of the (P, 4) planes a.x + b.y + c.z + d >= 0
+        leaves = []
+        frontier = np.zeros(1, int)
+        while len(frontier):
+            frontier = frontier[self.inside_planes(self.low[frontier], self.high[frontier], planes)]
+            is_leaf = self.children[frontier, 0] < 0
+            leaves.append(frontier[is_leaf])
+            frontier = self.children[frontier[~is_leaf]].ravel()
+
+        # a leaf may still hold a few items outside the frustum
+        items = self.leaf_items(np.concatenate(leaves))
+        items = items[self.inside_planes(self.bounds[items, 0], self.bounds[items, 1], planes)]
+        return np.sort(items)
+
+    def inside_planes(self, low: np.ndarray, high: np.ndarray, planes: np.ndarray) -> np.ndarray:
+        # test the box corner furthest along each plane normal
+        normals = planes[:, :3]
+        corner = np.where(normals[None] >= 0, high[:, None], low[:, None])
+        distance = (corner * normals[None]).sum(axis=2) + planes[:, 3]
+        return (distance >= 0).all(axis=1)
+
+    def query_ray(self, origin: np.ndarray, direction: np.ndarray) -> tuple:
+        # items whose box is hit by the ray, sorted by the distance where the ray enters the box
+        # a tiny component instead of zero keeps the slab test free of inf * 0
+        direction = np.asarray(direction, np.float64)
+        inverse = 1.0 / np.where(direction == 0, 1e-30, direction)
+        leaves = []
+        frontier = np.zeros(1, int)
+        while len(frontier):
+            near, far = self.intersect_boxes(self.low[frontier], self.high[frontier], origin, inverse)
+            frontier = frontier[near <= far]
+            is_leaf = self.children[frontier, 0] < 0
+            leaves.append(frontier[is_leaf])
+            frontier = self.children[frontier[~is_leaf]].ravel()
+
+        items = self.leaf_items(np.concatenate(leaves))
+        near, far = self.intersect_boxes(self.bounds[items, 0], self.bounds[items, 1], origin, inverse)
+        hit = near <= far
+        order = np.argsort(near[hit], kind="stable")
+        return items[hit][order], near[hit][order]
+
+    def intersect_boxes(self, low: np.ndarray, high: np.ndarray, origin: np.ndarray, inverse: np.ndarray) -> tuple:
+        # slab test, returns the entry and exit distance of the ray for every box
+        t0 = (low - origin) * inverse
+        t1 = (high - origin) * inverse
+        near = np.maximum(np.minimum(t0, t1).max(axis=1), 0)
+        far = np.maximum(t0, t1).min(axis=1)
+        return near, far
+
+def cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # row wise cross product, much cheaper than np.cross on small arrays
+    a, b = np.broadcast_arrays(a, b)
+    return np.stack([
+        a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+        a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+        a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    ], axis=-1)
+
+def intersect_triangles(origin: np.ndarray, direction: np.ndarray, a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    # Moller-Trumbore for (T, 3) corners, distance along the ray per triangle, inf when missed
+    ab, ac = b - a, c - a
+    p = cross(direction, ac)
+    det = (ab * p).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / det
+        s = origin - a
+        u = (s * p).sum(axis=1) * inverse
+        q = cross(s, ab)
+        v = (q @ direction) * inverse
+        t = (ac * q).sum(axis=1) * inverse
+    hit = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
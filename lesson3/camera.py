@@ -13,6 +13,10 @@ class Camera:
         self.aspect = 1
         self.height = 1
         self.width = 1
+        # matrices are cached until a parameter really changes, version counts the changes
+        self.version = 0
+        self.view = None
+        self.perspective = None
 
     def set(self, position: list, look_at: list, up: list, fovy: float, near: float) -> None:
         if (np.array_equal(position, look_at)):
@@ -23,24 +27,42 @@ class Camera:
             print ("failed: fov exceeds limit")
             return
 
+        # setting the same parameters again keeps the cached matrices; copies, so a caller
+        # editing its own lists and setting them again is seen as a change
+        position, look_at = list(position), list(look_at)
+        up = self.norm(np.array(up, np.float64))
+        if (self.version > 0 and np.array_equal(position, self.position) and np.array_equal(look_at, self.look_at)
+            and np.array_equal(up, self.up) and fovy == self.fovy and near == self.near):
+            return
+
         self.position = position
         self.look_at = look_at
-        self.up = self.norm(up)
+        self.up = up
         self.fovy = fovy
         self.near = near
         self.height = self.near*np.tan(self.fovy*np.pi/360)*2
         self.width = self.height*self.aspect
+        self.view = None
+        self.perspective = None
+        self.version += 1
 
     def get_perspective(self) -> np.ndarray:
+        if self.perspective is not None:
+            return self.perspective
         perspective_matrix = np.array([
             [self.near*2/self.width, 0, 0, 0],
             [0, self.near*2/self.height, 0, 0],
             [0, 0, 1, 0],
             [0, 0, -1, 0]
         ])
-        return np.matmul(perspective_matrix, self.get_orthographic())
+        self.perspective = np.matmul(perspective_matrix, self.get_orthographic())
+        # shared by every caller, so nobody may change it in place
+        self.perspective.flags.writeable = False
+        return self.perspective
 
     def get_orthographic(self) -> np.ndarray:
+        if self.view is not None:
+            return self.view
         z = self.norm(np.subtract(self.position, self.look_at))
         # use default up, if z & up is parallel
         if np.array_equal(z, self.up) or (np.array_equal(z, [-i for i in self.up])):
@@ -48,12 +70,14 @@ class Camera:
 
         x = self.norm(np.cross(self.up, z))
         y = self.norm(np.cross(z, x))
-        return np.array([
+        self.view = np.array([
             np.append(x, -self.look_at[0]),
             np.append(y, -self.look_at[1]),
             np.append(z, -np.linalg.norm(np.subtract(self.position, self.look_at))),
             [0, 0, 0, 1]
         ])
+        self.view.flags.writeable = False
+        return self.view
 
     def norm(self, v: np.ndarray) -> np.ndarray:
         norm = np.linalg.norm(v)
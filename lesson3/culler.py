@@ -0,0 +1,96 @@
+import numpy as np
+
+class Culler:
+    # drops the triangles that can't show up on screen before they are filled
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.reset()
+
+    def reset(self) -> None:
+        # counters of the current frame
+        self.triangles = 0
+        self.back_faces = 0
+        self.outside = 0
+        self.clipped = 0
+        self.drawn = 0
+
+    def report(self) -> dict:
+        return {
+            "triangles": self.triangles,
+            "back_faces": self.back_faces,
+            "outside": self.outside,
+            "clipped": self.clipped,
+            "drawn": self.drawn,
+        }
+
+    def clip_near(self, camera_pos: np.ndarray, indices: np.ndarray, near: float) -> tuple:
+        # clip the triangles against the near plane w = near in clip space,
+        # return the new vertices, the new indices and how the added vertices were made
+        corners = np.asarray(indices).reshape(-1, 3)
+        self.triangles += len(corners)
+        inside = camera_pos[:, 3][corners] >= near
+        count = inside.sum(axis=1)
+        no_lerp = (np.zeros(0, int), np.zeros(0, int), np.zeros(0))
+        if count.min(initial=3) == 3:
+            return camera_pos, corners.ravel(), no_lerp
+
+        self.outside += int((count == 0).sum())
+        self.clipped += int(((count == 1) | (count == 2)).sum())
+
+        # rotate every clipped triangle so its odd corner comes first, keeping the winding
+        one = corners[count == 1]
+        first = np.argmax(inside[count == 1], axis=1)
+        one = np.take_along_axis(one, (first[:, None] + np.arange(3)) % 3, axis=1)
+        two = corners[count == 2]
+        first = np.argmin(inside[count == 2], axis=1)
+        two = np.take_along_axis(two, (first[:, None] + np.arange(3)) % 3, axis=1)
+
+        # new vertices lie on the edges from an inside corner a to an outside corner b
+        a = np.concatenate([one[:, 0], one[:, 0], two[:, 2], two[:, 1]])
+        b = np.concatenate([one[:, 1], one[:, 2], two[:, 0], two[:, 0]])
+        wa, wb = camera_pos[a, 3], camera_pos[b, 3]
+        t = (wa - near) / (wa - wb)
+        added = camera_pos[a] + (camera_pos[b] - camera_pos[a]) * t[:, None]
+
+        # one inside: (a, ab, ac), two inside: (b, c, ca) and (b, ca, ab)
+        start = len(camera_pos)
+        n1, n2 = len(one), len(two)
+        ab1 = start + np.arange(n1)
+        ac1 = start + n1 + np.arange(n1)
+        ca2 = start + 2 * n1 + np.arange(n2)
+        ba2 = start + 2 * n1 + n2 + np.arange(n2)
+        corners = np.concatenate([
+            corners[count == 3],
+            np.stack([one[:, 0], ab1, ac1], axis=1),
+            np.stack([two[:, 1], two[:, 2], ca2], axis=1),
+            np.stack([two[:, 1], ca2, ba2], axis=1),
+        ])
+        return np.concatenate([camera_pos, added]), corners.ravel(), (a, b, t)
+
+    def interpolate(self, values: np.ndarray, lerp: tuple) -> np.ndarray:
+        # extend any per vertex attribute to the vertices added by clip_near
+        a, b, t = lerp
+        if len(a) == 0 or len(values) == 0:
+            return values
+        added = values[a] + (values[b] - values[a]) * t.reshape(-1, *[1] * (values.ndim - 1))
+        return np.concatenate([values, added.astype(values.dtype)])
+
+    def cull(self, positions: tuple, indices: np.ndarray, double_sided: bool) -> np.ndarray:
+        # drop the back faces and the triangles completely outside the screen
+        px, py, depth = positions
+        corners = np.asarray(indices).reshape(-1, 3)
+        x, y = px[corners], py[corners]
+        keep = ~((x.max(axis=1) < 0) | (x.min(axis=1) >= self.width)
+            | (y.max(axis=1) < 0) | (y.min(axis=1) >= self.height))
+        self.outside += int((~keep).sum())
+
+        if not double_sided:
+            # counter-clockwise triangles face the camera, y points down on screen
+            area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (y[:, 1] - y[:, 0]) * (x[:, 2] - x[:, 0])
+            back = keep & (area >= 0)
+            self.back_faces += int(back.sum())
+            keep &= ~back
+
+        self.drawn += int(keep.sum())
+        return corners[keep].ravel()
@@ -1,5 +1,7 @@
 import numpy as np
-from triangle import Vertice
+
+# pixels per side of a block in the finest level of the depth pyramid
+HIZ_BLOCK = 8
 
 class DepthManager:
     def __init__(self, width: int, height: int) -> None:
@@ -7,24 +9,100 @@ class DepthManager:
         self.min_depth = float('inf')
         self.max_depth = float('-inf')
         self.depth_ratio = 1.0
+        # pixels already taken by equal_pixels
+        self.passed = np.zeros((height, width), bool)
+
+        # hierarchical z: every level keeps the farthest depth of its blocks, each level
+        # has blocks twice as wide as the one before, down to a single block
+        self.pyramid = []
+        rows, columns = -(-height // HIZ_BLOCK), -(-width // HIZ_BLOCK)
+        while True:
+            self.pyramid.append(np.full((rows, columns), float("-inf"), np.float32))
+            if rows == 1 and columns == 1:
+                break
+            rows, columns = -(-rows // 2), -(-columns // 2)
+
+    def clear(self) -> None:
+        self.depth_map.fill(float("-inf"))
+        self.passed.fill(False)
+        for level in self.pyramid:
+            level.fill(float("-inf"))
+        self.min_depth = float('inf')
+        self.max_depth = float('-inf')
+        self.depth_ratio = 1.0
 
-    def add_depth(self, depth: float) -> None:
-        self.min_depth = min(self.min_depth, depth)
-        self.max_depth = max(self.max_depth, depth)
+    def update_pyramid(self, x0: int, y0: int, x1: int, y1: int) -> None:
+        # refresh the blocks over the pixels x0..x1, y0..y1 after they were written
+        size = HIZ_BLOCK
+        source = self.depth_map
+        for level in self.pyramid:
+            x0, y0, x1, y1 = x0 // size, y0 // size, x1 // size, y1 // size
+            region = source[y0 * size:(y1 + 1) * size, x0 * size:(x1 + 1) * size]
+            rows = np.minimum.reduceat(region, np.arange(0, region.shape[0], size), axis=0)
+            level[y0:y1 + 1, x0:x1 + 1] = np.minimum.reduceat(rows, np.arange(0, region.shape[1], size), axis=1)
+            size, source = 2, level
+
+    def occluded(self, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, nearest: np.ndarray) -> np.ndarray:
+        # mask of the on screen pixel rectangles whose nearest depth is behind everything drawn
+        # over them; each is tested on the level where it spans at most 2 x 2 blocks
+        span = np.maximum(x1 - x0, y1 - y0) // HIZ_BLOCK + 1
+        levels = np.minimum(np.ceil(np.log2(span)).astype(int), len(self.pyramid) - 1)
+        result = np.zeros(len(x0), bool)
+        for level in np.unique(levels):
+            pick = np.nonzero(levels == level)[0]
+            shift = HIZ_BLOCK.bit_length() - 1 + level
+            blocks = self.pyramid[level]
+            bx0, by0 = x0[pick] >> shift, y0[pick] >> shift
+            bx1, by1 = x1[pick] >> shift, y1[pick] >> shift
+            farthest = np.minimum(
+                np.minimum(blocks[by0, bx0], blocks[by0, np.minimum(bx0 + 1, bx1)]),
+                np.minimum(blocks[np.minimum(by0 + 1, by1), bx0], blocks[np.minimum(by0 + 1, by1), np.minimum(bx0 + 1, bx1)]))
+            result[pick] = nearest[pick] < farthest
+        return result
+
+    def add_depth(self, depths: np.ndarray) -> None:
+        if len(depths) == 0:
+            return
+        self.min_depth = min(self.min_depth, float(np.min(depths)))
+        self.max_depth = max(self.max_depth, float(np.max(depths)))
 
     def calc_depth_ratio(self) -> None:
         if (self.max_depth != self.min_depth):
             self.depth_ratio = 255/abs(self.max_depth - self.min_depth)
 
-    def get_color(self, point: Vertice) -> tuple:
-        # reutrn normalized color(0-255)
-        color_value = int(255 + (point.depth - self.max_depth) * self.depth_ratio)
-        return (color_value, color_value, color_value)
-
-    def override(self, point: Vertice) -> bool:
-        old_depth = self.depth_map[point.y][point.x]
-        if point.depth > old_depth:
-            self.depth_map[point.y][point.x] = point.depth
-            return True
-        else:
-            return False
+    def get_color(self, depths: np.ndarray) -> np.ndarray:
+        # return normalized gray colors(0-255), one row per depth
+        values = 255 + (np.asarray(depths) - self.max_depth) * self.depth_ratio
+        return np.repeat(np.clip(values, 0, 255).astype(np.uint8)[..., None], 3, axis=-1)
+
+    def override_pixels(self, xs: np.ndarray, ys: np.ndarray, depths: np.ndarray) -> np.ndarray:
+        # depth test a batch of pixels at once, return the mask of the ones that passed;
+        # when a pixel shows up several times only the nearest one passes (the first on ties)
+        depths = np.asarray(depths, self.depth_map.dtype)
+        candidates = np.nonzero(depths > self.depth_map[ys, xs])[0]
+
+        pixels = ys[candidates] * self.depth_map.shape[1] + xs[candidates]
+        order = np.lexsort((-depths[candidates], pixels))
+        pixels = pixels[order]
+        nearest = np.ones(len(order), bool)
+        nearest[1:] = pixels[1:] != pixels[:-1]
+        winners = candidates[order[nearest]]
+
+        self.depth_map[ys[winners], xs[winners]] = depths[winners]
+        if len(winners):
+            self.update_pyramid(xs[winners].min(), ys[winners].min(), xs[winners].max(), ys[winners].max())
+        passed = np.zeros(len(depths), bool)
+        passed[winners] = True
+        return passed
+
+    def equal_pixels(self, xs: np.ndarray, ys: np.ndarray, depths: np.ndarray) -> np.ndarray:
+        # mask of the pixels whose depth is the one a depth pre-pass left; like override_pixels
+        # the first fragment wins a tie, so each pixel passes once until the next clear
+        equal = np.asarray(depths, self.depth_map.dtype) == self.depth_map[ys, xs]
+        candidates = np.nonzero(equal & ~self.passed[ys, xs])[0]
+        _, first = np.unique(ys[candidates] * self.depth_map.shape[1] + xs[candidates], return_index=True)
+        winners = candidates[first]
+        self.passed[ys[winners], xs[winners]] = True
+        passed = np.zeros(len(depths), bool)
+        passed[winners] = True
+        return passed
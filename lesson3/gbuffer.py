@@ -0,0 +1,43 @@
+import numpy as np
+
+# storage of every varying kept per pixel, world positions are rebuilt from the depth instead
+GBUFFER_TYPES = {
+    "uv": np.float32,
+    "normal": np.float16,
+    "color": np.float16,
+}
+
+class GBuffer:
+    # what the geometry pass leaves behind for every pixel: the shader that draws it
+    # and the varyings that shader reads, so the resolve pass shades each pixel once
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.shader = np.full((height, width), -1, np.int32)
+        # (height, width, k) arrays by varying name, made the first time a name is written
+        self.varyings = {}
+        self.clear()
+
+    def clear(self) -> None:
+        # only the shader ids are reset, varyings of uncovered pixels are never read
+        self.shader.fill(-1)
+        # (material, varying names) of every shader id
+        self.shaders = []
+
+    def get_shader(self, material, names: list) -> int:
+        for i, (m, n) in enumerate(self.shaders):
+            if m is material and n == names:
+                return i
+        self.shaders.append((material, names))
+        return len(self.shaders) - 1
+
+    def write(self, xs: np.ndarray, ys: np.ndarray, shader: int, fragments: dict) -> None:
+        # store the fragments that passed the depth test, nearer ones later overwrite them
+        self.shader[ys, xs] = shader
+        for name, values in fragments.items():
+            if name not in self.varyings:
+                self.varyings[name] = np.zeros((self.height, self.width, values.shape[1]), GBUFFER_TYPES[name])
+            self.varyings[name][ys, xs] = values
+
+    def read(self, xs: np.ndarray, ys: np.ndarray, names: list) -> dict:
+        return {name: self.varyings[name][ys, xs].astype(np.float64) for name in names if name in self.varyings}
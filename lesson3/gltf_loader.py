@@ -1,116 +1,303 @@
-import struct
+import os
+from urllib.parse import unquote
+import numpy as np
 from pygltflib import GLTF2
-from PIL import Image
-from triangle import Mesh, PBRMaterial, Primitive
+from animation import Animation, Sampler, Skin, CUBICSPLINE, LINEAR
+from buffer_manager import BufferManager, decode_data_uri, load_document
+from lod import build_lods
+from mesh_optimizer import optimize_primitive
+from texture import Texture, texture_cache
+from triangle import Node, Mesh, PBRMaterial, Primitive, compose_matrices
+
+# glTF componentType -> numpy dtype
+COMPONENT_TYPES = {
+    5120: np.int8,
+    5121: np.uint8,
+    5122: np.int16,
+    5123: np.uint16,
+    5125: np.uint32,
+    5126: np.float32,
+}
+
+# glTF accessor type -> number of components
+TYPE_SIZES = {
+    "SCALAR": 1,
+    "VEC2": 2,
+    "VEC3": 3,
+    "VEC4": 4,
+    "MAT2": 4,
+    "MAT3": 9,
+    "MAT4": 16,
+}
+
+def read_accessor(gltf: GLTF2, index: int, buffers: BufferManager) -> np.ndarray:
+    # return a (count, k) view over the buffer, nothing is copied unless the accessor is sparse
+    accessor = gltf.accessors[index]
+    dtype = np.dtype(COMPONENT_TYPES[accessor.componentType]).newbyteorder("<")
+    size = TYPE_SIZES[accessor.type]
+    if accessor.bufferView == None:
+        # all zeros, like a morph target that only moves the vertices its sparse part lists
+        values = np.zeros((accessor.count, size), dtype)
+    else:
+        bufferView = gltf.bufferViews[accessor.bufferView]
+        offset = accessor.byteOffset or 0
+        # tightly packed unless the bufferView says otherwise
+        stride = bufferView.byteStride or dtype.itemsize * size
+        values = np.ndarray((accessor.count, size), dtype, buffers.view(accessor.bufferView), offset, (stride, dtype.itemsize))
+
+    sparse = accessor.sparse
+    if sparse != None and sparse.count:
+        indices = np.frombuffer(buffers.view(sparse.indices.bufferView), np.dtype(COMPONENT_TYPES[sparse.indices.componentType]).newbyteorder("<"),
+            sparse.count, sparse.indices.byteOffset or 0)
+        values = values.copy()
+        values[indices] = np.frombuffer(buffers.view(sparse.values.bufferView), dtype, sparse.count * size, sparse.values.byteOffset or 0).reshape(-1, size)
+    return values
+
+def read_attribute(gltf: GLTF2, index: int, buffers: BufferManager, size: int = 3) -> np.ndarray:
+    if index == None:
+        return np.zeros((0, size), np.float32)
+
+    values = read_accessor(gltf, index, buffers)
+    if values.dtype == np.float32:
+        return values
+
+    # integer attributes (e.g. quantized uvs) are converted to float32
+    result = values.astype(np.float32)
+    if gltf.accessors[index].normalized:
+        info = np.iinfo(values.dtype)
+        result = np.maximum(result / info.max, -1.0)
+    return result
+
+def read_bounds(gltf: GLTF2, index: int, vertices: np.ndarray) -> np.ndarray:
+    # local (2, 3) box of a POSITION accessor, glTF requires min and max on it
+    accessor = gltf.accessors[index]
+    if accessor.min != None and accessor.max != None:
+        return np.array([accessor.min[:3], accessor.max[:3]], np.float64)
+    if len(vertices) == 0:
+        return np.zeros((2, 3))
+    return np.array([vertices.min(axis=0), vertices.max(axis=0)], np.float64)
+
+def read_indices(gltf: GLTF2, index: int, count: int, buffers: BufferManager) -> np.ndarray:
+    # non-indexed primitives draw the vertices in order
+    if index == None:
+        return np.arange(count, dtype=np.uint32)
+    return read_accessor(gltf, index, buffers)[:, 0]
+
+def read_instances(gltf: GLTF2, node, buffers: BufferManager) -> np.ndarray:
+    # (M, 4, 4) matrices of EXT_mesh_gpu_instancing, relative to the node, or None without it
+    extension = (node.extensions or {}).get("EXT_mesh_gpu_instancing")
+    if extension == None:
+        return None
+    attributes = extension.get("attributes", {})
+    count = gltf.accessors[next(iter(attributes.values()))].count
+    translations, rotations, scales = np.zeros((count, 3)), np.tile([0.0, 0, 0, 1], (count, 1)), np.ones((count, 3))
+    if "TRANSLATION" in attributes:
+        translations = read_attribute(gltf, attributes["TRANSLATION"], buffers)
+    if "ROTATION" in attributes:
+        rotations = read_attribute(gltf, attributes["ROTATION"], buffers, 4)
+    if "SCALE" in attributes:
+        scales = read_attribute(gltf, attributes["SCALE"], buffers)
+    return compose_matrices(translations, rotations, scales)
+
+def read_matrices(gltf: GLTF2, index: int, buffers: BufferManager) -> np.ndarray:
+    # (count, 4, 4) row major matrices of a MAT4 accessor, glTF stores them column major
+    return read_attribute(gltf, index, buffers, 16).reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+def read_sampler(gltf: GLTF2, sampler, buffers: BufferManager) -> Sampler:
+    times = read_attribute(gltf, sampler.input, buffers, 1)[:, 0]
+    values = read_attribute(gltf, sampler.output, buffers, 1)
+    interpolation = sampler.interpolation or LINEAR
+    # morph weights come as one scalar per target and keyframe, cubic splines have 3 values a keyframe
+    values = values.reshape(len(times), 3, -1) if interpolation == CUBICSPLINE else values.reshape(len(times), -1)
+    return Sampler(times, values, interpolation)
+
+def get_attribute(attributes, name: str) -> int:
+    # morph targets come as plain dicts, primitive attributes as objects
+    return attributes.get(name) if isinstance(attributes, dict) else getattr(attributes, name, None)
 
 class GltfLoader:
+    def __init__(self, lod: bool = False, optimize: bool = False) -> None:
+        # build the levels of detail of every primitive while loading
+        self.lod = lod
+        # weld and reorder the vertices and triangles of every primitive for cache locality
+        self.optimize = optimize
+        # every file the last load read from, the model first
+        self.files = []
+        # animation.Animation of the last load
+        self.animations = []
+
     def load(self, path: str) -> list:
-        gltf = GLTF2().load(path)
+        # .gltf or .glb, buffers are only read once an accessor needs them
+        gltf, binary = load_document(path)
+        buffers = BufferManager(gltf, path, binary)
+        folder = os.path.dirname(path)
+        self.files = [path]
+        for buffer in gltf.buffers:
+            if buffer.uri != None and not buffer.uri.startswith("data:"):
+                self.files.append(os.path.join(folder, unquote(buffer.uri)))
+
+        # only what the nodes of the scene draw is decoded: their meshes, the materials
+        # of those and the textures of the materials; other nodes get no primitives
+        scene = self.scene_nodes(gltf)
+        used_meshes = sorted({gltf.nodes[i].mesh for i in scene if gltf.nodes[i].mesh != None})
+        used_materials = sorted({p.material for i in used_meshes for p in gltf.meshes[i].primitives if p.material != None})
+        used_textures = sorted({gltf.materials[i].pbrMetallicRoughness.baseColorTexture.index for i in used_materials
+            if gltf.materials[i].pbrMetallicRoughness.baseColorTexture != None})
 
-        # read all the images
-        textures = []
-        for image in gltf.images:
-            textures.append(Image.open(image.uri))
+        # the images are decoded once and shared through the cache
+        textures = {}
+        for i in used_textures:
+            texture = gltf.textures[i]
+            texels = self.read_image(gltf, texture.source, path, buffers)
+            if texture.sampler == None:
+                textures[i] = Texture(texels)
+            else:
+                sampler = gltf.samplers[texture.sampler]
+                textures[i] = Texture(texels, sampler.magFilter, sampler.wrapS, sampler.wrapT)
 
-        # read all the materials
-        materials = []
-        for mat in gltf.materials:
+        materials = {}
+        for i in used_materials:
+            mat = gltf.materials[i]
             m = PBRMaterial()
+            m.double_sided = bool(mat.doubleSided)
+            if mat.pbrMetallicRoughness.metallicFactor != None:
+                m.metallic = mat.pbrMetallicRoughness.metallicFactor
+            if mat.pbrMetallicRoughness.roughnessFactor != None:
+                m.roughness = mat.pbrMetallicRoughness.roughnessFactor
             if mat.pbrMetallicRoughness.baseColorTexture == None:
                 f = mat.pbrMetallicRoughness.baseColorFactor
                 m.color = [int(255 * f[0]), int(255 * f[1]), int(255 * f[2])]
             else:
-                m.texture =  textures[mat.pbrMetallicRoughness.baseColorTexture.index]
-            materials.append(m)
+                m.texture = textures[mat.pbrMetallicRoughness.baseColorTexture.index]
+            materials[i] = m
 
-        # read all the meshes
-        meshes = []
-        for node in gltf.nodes:
-            if node.mesh == None:
-                continue
-            
-            mesh = gltf.meshes[node.mesh]
-
-            primitives = []
-
-            # get the vertices for each primitive in the mesh (in this example there is only one)
-            for primitive in mesh.primitives:
-                # get all vertices
-                # get the binary data for this mesh primitive from the buffer
-                accessor = gltf.accessors[primitive.attributes.POSITION]
-                bufferView = gltf.bufferViews[accessor.bufferView]
-                buffer = gltf.buffers[bufferView.buffer]
-                data = gltf.get_data_from_buffer_uri(buffer.uri)
-                dataLength = (int)(bufferView.byteLength / accessor.count)
-
-                # pull each vertex from the binary buffer and convert it into a tuple of python floats
-                vertices = []
-                for i in range(accessor.count):
-                    index = bufferView.byteOffset + accessor.byteOffset + i * dataLength  # the location in the buffer of this vertex
-                    d = data[index:index + dataLength]  # the vertex data
-                    v = struct.unpack("<fff", d)   # convert from base64 to three floats
-                    vertices.append(list(v))
-
-                # get all normals
-                # get the binary data for this mesh primitive from the buffer
-                accessor = gltf.accessors[primitive.attributes.NORMAL]
-                bufferView = gltf.bufferViews[accessor.bufferView]
-                buffer = gltf.buffers[bufferView.buffer]
-                data = gltf.get_data_from_buffer_uri(buffer.uri)
-                dataLength = (int)(bufferView.byteLength / accessor.count)
-
-                # pull each vertex from the binary buffer and convert it into a tuple of python floats
-                normals = []
-                for i in range(accessor.count):
-                    index = bufferView.byteOffset + accessor.byteOffset + i * dataLength  # the location in the buffer of this vertex
-                    d = data[index:index + dataLength]
-                    v = struct.unpack("<fff", d)   # convert from base64 to three floats
-                    normals.append(v)
-
-                # get all uvs
-                # get the binary data for this mesh primitive from the buffer
-                accessor = gltf.accessors[primitive.attributes.TEXCOORD_0]
-                bufferView = gltf.bufferViews[accessor.bufferView]
-                buffer = gltf.buffers[bufferView.buffer]
-                data = gltf.get_data_from_buffer_uri(buffer.uri)
-                dataLength = (int)(bufferView.byteLength / accessor.count)
-
-                # pull each vertex from the binary buffer and convert it into a tuple of python floats
-                uvs = []
-                for i in range(accessor.count):
-                    index = bufferView.byteOffset + accessor.byteOffset + i * dataLength  # the location in the buffer of this vertex
-                    uv = data[index:index + dataLength]
-                    value = struct.unpack("ff", uv)   # convert from base64 to two floats
-                    uvs.append(value)
-
-                # get all indices
-                # get the binary data for this mesh primitive from the buffer
-                accessor = gltf.accessors[primitive.indices]
-                bufferView = gltf.bufferViews[accessor.bufferView]
-                buffer = gltf.buffers[bufferView.buffer]
-                data = gltf.get_data_from_buffer_uri(buffer.uri)
-                dataLength = (int)(bufferView.byteLength / accessor.count)
-
-                # pull each vertex from the binary buffer and convert it into a tuple of python floats
-                indices = []
-                for i in range(accessor.count):
-                    index = bufferView.byteOffset + accessor.byteOffset + i * dataLength  # the location in the buffer of this vertex
-                    indice = data[index:index + dataLength]
-                    val = struct.unpack("h", indice)
-                    indices.append(val[0])
-                p = Primitive()
-                p.vertices = vertices
-                p.normals = normals
-                p.uvs = uvs
-                p.indices = indices
-                if primitive.material != None:
-                    p.material = materials[primitive.material]
-                primitives.append(p)
-            m = Mesh()
-            m.primitives = primitives
-            m.name = mesh.name
-            m.set_scale(node.scale)
-            m.set_translation(node.translation)
-            meshes.append(m)
+        # decode every mesh once, nodes that instance it share its primitives
+        primitives = {i: self.read_primitives(gltf, gltf.meshes[i], materials, buffers) for i in used_meshes}
+        if self.optimize:
+            for primitive in (p for mesh in primitives.values() for p in mesh):
+                optimize_primitive(primitive)
+        if self.lod:
+            for primitive in (p for mesh in primitives.values() for p in mesh):
+                primitive.lods = build_lods(primitive)
+
+        # build the node hierarchy, and return the nodes of the scene that draw a mesh
+        nodes = []
+        for i, node in enumerate(gltf.nodes):
+            n = Node() if node.mesh == None or i not in scene else Mesh()
+            n.name = node.name or ('' if node.mesh == None else gltf.meshes[node.mesh].name)
+            if isinstance(n, Mesh):
+                n.primitives = primitives[node.mesh]
+                n.instances = read_instances(gltf, node, buffers)
+            n.set_matrix(node.matrix)
+            n.set_translation(node.translation)
+            n.set_rotation(node.rotation)
+            n.set_scale(node.scale)
+            nodes.append(n)
+        for node, n in zip(gltf.nodes, nodes):
+            for child in node.children:
+                n.add_child(nodes[child])
+            if isinstance(n, Mesh):
+                # node weights override the mesh weights, targets without either rest at zero;
+                # pygltflib does not know node weights, so they are only there when it keeps them
+                targets = max((len(p.targets) for p in n.primitives), default=0)
+                weights = getattr(node, "weights", None) or gltf.meshes[node.mesh].weights or [0.0] * targets
+                n.weights = np.array(weights, np.float64)
+            if node.skin != None and isinstance(n, Mesh):
+                skin = gltf.skins[node.skin]
+                if skin.inverseBindMatrices == None:
+                    inverse_binds = np.tile(np.identity(4), (len(skin.joints), 1, 1))
+                else:
+                    inverse_binds = read_matrices(gltf, skin.inverseBindMatrices, buffers)
+                n.skin = Skin([nodes[j] for j in skin.joints], inverse_binds)
+
+        # animations keep only the channels of the nodes in the scene and of the joints its skins use,
+        # the keyframes of the others are never read
+        animated = scene | {j for i in scene if isinstance(nodes[i], Mesh) and gltf.nodes[i].skin != None for j in gltf.skins[gltf.nodes[i].skin].joints}
+        self.animations = []
+        for i, animation in enumerate(gltf.animations):
+            samplers = {}
+            channels = []
+            for c in animation.channels:
+                if c.target.node in animated:
+                    if c.sampler not in samplers:
+                        samplers[c.sampler] = read_sampler(gltf, animation.samplers[c.sampler], buffers)
+                    channels.append((nodes[c.target.node], c.target.path, samplers[c.sampler]))
+            self.animations.append(Animation(animation.name or "animation%d" % i, channels))
 
+        meshes = []
+        stack = list(reversed(self.scene_roots(gltf)))
+        while stack:
+            i = stack.pop()
+            if isinstance(nodes[i], Mesh):
+                meshes.append(nodes[i])
+            stack.extend(reversed(gltf.nodes[i].children))
         return meshes
+
+    def read_image(self, gltf: GLTF2, index: int, path: str, buffers: BufferManager) -> np.ndarray:
+        # images are files next to the model, or bytes in a data uri or a bufferView;
+        # embedded ones are cached under the model path and their index
+        image = gltf.images[index]
+        if image.uri != None and not image.uri.startswith("data:"):
+            file = os.path.join(os.path.dirname(path), unquote(image.uri))
+            self.files.append(file)
+            return texture_cache.get(file)
+        key = "%s#image%d" % (path, index)
+        if image.uri != None:
+            return texture_cache.get(key, lambda: decode_data_uri(image.uri))
+        return texture_cache.get(key, lambda: buffers.view(image.bufferView))
+
+    def scene_nodes(self, gltf: GLTF2) -> set:
+        # indices of the scene roots and everything below them
+        scene = set()
+        stack = list(self.scene_roots(gltf))
+        while stack:
+            i = stack.pop()
+            if i not in scene:
+                scene.add(i)
+                stack.extend(gltf.nodes[i].children)
+        return scene
+
+    def scene_roots(self, gltf: GLTF2) -> list:
+        # the nodes of the default scene, or every node without a parent when there are no scenes
+        if gltf.scenes:
+            return gltf.scenes[gltf.scene or 0].nodes
+        children = {child for node in gltf.nodes for child in node.children}
+        return [i for i in range(len(gltf.nodes)) if i not in children]
+
+    def read_primitives(self, gltf: GLTF2, mesh, materials: dict, buffers: BufferManager) -> list:
+        primitives = []
+        for primitive in mesh.primitives:
+            # every accessor is read as one numpy view over the buffer
+            vertices = read_attribute(gltf, primitive.attributes.POSITION, buffers)
+            normals = read_attribute(gltf, primitive.attributes.NORMAL, buffers)
+            uvs = read_attribute(gltf, primitive.attributes.TEXCOORD_0, buffers, 2)
+            # vertex colors may come with alpha, only rgb is used
+            colors = read_attribute(gltf, primitive.attributes.COLOR_0, buffers)[:, :3]
+            indices = read_indices(gltf, primitive.indices, len(vertices), buffers)
+            p = Primitive()
+            p.vertices = vertices
+            p.bounds = read_bounds(gltf, primitive.attributes.POSITION, vertices)
+            p.normals = normals
+            p.uvs = uvs
+            p.colors = colors
+            p.indices = indices
+            if primitive.attributes.JOINTS_0 != None and primitive.attributes.WEIGHTS_0 != None:
+                p.joints = read_accessor(gltf, primitive.attributes.JOINTS_0, buffers).astype(np.intp)
+                p.skin_weights = read_attribute(gltf, primitive.attributes.WEIGHTS_0, buffers, 4)
+            if primitive.targets:
+                p.targets = self.read_targets(gltf, primitive.targets, "POSITION", len(vertices), buffers)
+                if len(normals):
+                    p.target_normals = self.read_targets(gltf, primitive.targets, "NORMAL", len(vertices), buffers)
+            if primitive.material != None:
+                p.material = materials[primitive.material]
+            primitives.append(p)
+        return primitives
+
+    def read_targets(self, gltf: GLTF2, targets: list, name: str, count: int, buffers: BufferManager) -> np.ndarray:
+        # (T, N, 3) offsets of one attribute in every morph target, zero where a target leaves it out
+        result = np.zeros((len(targets), count, 3), np.float32)
+        for i, target in enumerate(targets):
+            index = get_attribute(target, name)
+            if index != None:
+                result[i] = read_attribute(gltf, index, buffers)
+        return result
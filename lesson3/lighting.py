@@ -0,0 +1,104 @@
+import numpy as np
+
+# shading models
+UNLIT = "unlit"
+LAMBERT = "lambert"
+BLINN_PHONG = "blinn_phong"
+PBR = "pbr"
+
+# reflectance of every dielectric at normal incidence
+DIELECTRIC_F0 = 0.04
+
+class DirectionalLight:
+    # light from infinitely far away, direction is where the light travels to
+    def __init__(self, direction: list, color: list = [1, 1, 1], intensity: float = 1.0) -> None:
+        self.direction = np.asarray(direction, np.float64) / np.linalg.norm(direction)
+        self.color = np.asarray(color, np.float64)
+        self.intensity = intensity
+
+    def illuminate(self, world: np.ndarray) -> tuple:
+        # (N, 3) unit vectors towards the light and the (N, 3) light arriving at each point
+        to_light = np.broadcast_to(-self.direction, world.shape)
+        return to_light, np.broadcast_to(self.color * self.intensity, world.shape)
+
+class PointLight:
+    # light from one point, falling off with the squared distance until range
+    def __init__(self, position: list, color: list = [1, 1, 1], intensity: float = 1.0, range: float = None) -> None:
+        self.position = np.asarray(position, np.float64)
+        self.color = np.asarray(color, np.float64)
+        self.intensity = intensity
+        self.range = range
+
+    def illuminate(self, world: np.ndarray) -> tuple:
+        to_light = self.position - world
+        distance = np.maximum(np.sqrt((to_light * to_light).sum(axis=1)), 1e-6)
+        falloff = 1 / distance**2
+        if self.range != None:
+            # the windowing of KHR_lights_punctual, so the light fades out at range
+            falloff *= np.clip(1 - (distance / self.range)**4, 0, 1)**2
+        return to_light / distance[:, None], self.color * self.intensity * falloff[:, None]
+
+def normalize(v: np.ndarray) -> np.ndarray:
+    length = np.sqrt((v * v).sum(axis=1, keepdims=True))
+    return v / np.maximum(length, 1e-12)
+
+def dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # row wise dot product, clamped at zero like every lighting term
+    return np.maximum((a * b).sum(axis=1), 0)
+
+def to_linear(colors: np.ndarray) -> np.ndarray:
+    # uint8 srgb colors to linear floats in 0..1, lighting adds up light in linear space
+    return (np.asarray(colors, np.float64) / 255) ** 2.2
+
+def to_srgb(colors: np.ndarray) -> np.ndarray:
+    return (np.clip(colors, 0, 1) ** (1 / 2.2) * 255 + 0.5).astype(np.uint8)
+
+def shade_lambert(albedo: np.ndarray, normals: np.ndarray, world: np.ndarray, lights: list, ambient: float) -> np.ndarray:
+    # diffuse only, every input is (N, 3) and so is the linear result
+    result = albedo * ambient
+    for light in lights:
+        to_light, radiance = light.illuminate(world)
+        result = result + albedo * radiance * dot(normals, to_light)[:, None]
+    return result
+
+def shade_blinn_phong(albedo: np.ndarray, normals: np.ndarray, world: np.ndarray, eye: np.ndarray, lights: list, ambient: float,
+    metallic: float, roughness: float) -> np.ndarray:
+    # lambert plus a specular highlight around the half vector, the glTF factors
+    # pick its tint and the usual shininess of the same roughness
+    alpha = max(roughness, 0.05) ** 2
+    shininess = 2 / alpha**2 - 2
+    specular = DIELECTRIC_F0 * (1 - metallic) + albedo * metallic
+    diffuse = albedo * (1 - metallic)
+    to_eye = normalize(eye - world)
+    result = albedo * ambient
+    for light in lights:
+        to_light, radiance = light.illuminate(world)
+        half = normalize(to_light + to_eye)
+        highlight = dot(normals, half) ** shininess * (shininess + 8) / 8
+        result = result + (diffuse + specular * highlight[:, None]) * radiance * dot(normals, to_light)[:, None]
+    return result
+
+def shade_pbr(albedo: np.ndarray, normals: np.ndarray, world: np.ndarray, eye: np.ndarray, lights: list, ambient: float,
+    metallic: float, roughness: float) -> np.ndarray:
+    # glTF metallic-roughness: GGX distribution, Smith geometry and Schlick fresnel;
+    # diffuse and specular are scaled by pi so a light has the same strength as in lambert
+    alpha = max(roughness, 0.05) ** 2
+    f0 = DIELECTRIC_F0 * (1 - metallic) + albedo * metallic
+    k = (roughness + 1) ** 2 / 8
+    to_eye = normalize(eye - world)
+    n_v = np.maximum(dot(normals, to_eye), 1e-4)
+    result = albedo * ambient
+    for light in lights:
+        to_light, radiance = light.illuminate(world)
+        half = normalize(to_light + to_eye)
+        n_l = dot(normals, to_light)
+        n_h = dot(normals, half)
+        v_h = dot(to_eye, half)
+
+        d = alpha**2 / (np.pi * (n_h**2 * (alpha**2 - 1) + 1) ** 2)
+        g = n_v / (n_v * (1 - k) + k) * n_l / (n_l * (1 - k) + k)
+        f = f0 + (1 - f0) * ((1 - v_h) ** 5)[:, None]
+        specular = f * (d * g / (4 * n_v * np.maximum(n_l, 1e-4)))[:, None]
+        diffuse = (1 - f) * (1 - metallic) * albedo / np.pi
+        result = result + np.pi * (diffuse + specular) * radiance * n_l[:, None]
+    return result
@@ -0,0 +1,158 @@
+import heapq
+import numpy as np
+from triangle import Primitive
+
+# triangle counts of the coarser levels, relative to the full primitive
+LOD_RATIOS = [0.5, 0.25, 0.125]
+# primitives smaller than this are always drawn in full
+LOD_MIN_TRIANGLES = 64
+
+def build_lods(primitive: Primitive, ratios: list = LOD_RATIOS) -> list:
+    # index buffers of coarser versions of a primitive, made by quadric error edge collapses;
+    # vertices only ever move onto others, so every level shares the vertex arrays
+    indices = np.asarray(primitive.indices)
+    count = len(indices) // 3
+    if count < LOD_MIN_TRIANGLES:
+        return []
+    targets = [int(count * ratio) for ratio in ratios]
+    return [level.astype(indices.dtype) for level in Simplifier(primitive).run(targets)]
+
+class Simplifier:
+    # half edge collapses over the welded positions, cheapest quadric error first;
+    # corners keep pointing at real vertices, the one at the new position with the closest attributes
+    def __init__(self, primitive: Primitive) -> None:
+        vertices = np.asarray(primitive.vertices, np.float64)
+        corners = np.asarray(primitive.indices, np.int64).reshape(-1, 3)
+        # uv and normal seams split vertices, the topology only knows positions
+        positions, weld = np.unique(vertices, axis=0, return_inverse=True)
+        weld = weld.ravel()
+        self.positions = positions
+        self.welded = weld[corners]
+        self.corners = corners
+        self.alive = np.ones(len(corners), bool)
+        self.alive &= (self.welded[:, 0] != self.welded[:, 1]) & (self.welded[:, 1] != self.welded[:, 2]) & (self.welded[:, 2] != self.welded[:, 0])
+
+        # attributes that decide which vertex at a position a corner moves to
+        attributes = [np.asarray(a, np.float64) for a in (primitive.normals, primitive.uvs) if len(a)]
+        self.attributes = np.hstack(attributes) if attributes else np.zeros((len(vertices), 0))
+        self.split = [[] for _ in range(len(positions))]
+        for vertex, position in enumerate(weld):
+            self.split[position].append(vertex)
+
+        self.triangles = [set() for _ in range(len(positions))]
+        for t in np.nonzero(self.alive)[0]:
+            for p in self.welded[t]:
+                self.triangles[p].add(int(t))
+        self.quadrics = self.plane_quadrics()
+        self.locked = self.border_positions()
+        self.stamps = [0] * len(positions)
+
+    def plane_quadrics(self) -> np.ndarray:
+        # (P, 4, 4) sums of the area weighted plane quadrics of the triangles around each position
+        a, b, c = (self.positions[self.welded[self.alive][:, k]] for k in range(3))
+        normals = np.cross(b - a, c - a)
+        areas = np.sqrt((normals * normals).sum(axis=1))
+        planes = np.hstack([normals, -(normals * a).sum(axis=1, keepdims=True)]) / np.maximum(areas, 1e-12)[:, None]
+        quadrics = planes[:, :, None] * planes[:, None, :] * (areas / 2)[:, None, None]
+        result = np.zeros((len(self.positions), 4, 4))
+        for k in range(3):
+            np.add.at(result, self.welded[self.alive][:, k], quadrics)
+        return result
+
+    def border_positions(self) -> np.ndarray:
+        # ends of edges with a single triangle stay where they are, so holes and outlines keep their shape
+        welded = self.welded[self.alive]
+        edges = np.sort(np.concatenate([welded[:, [0, 1]], welded[:, [1, 2]], welded[:, [2, 0]]]), axis=1)
+        edges, counts = np.unique(edges, axis=0, return_counts=True)
+        locked = np.zeros(len(self.positions), bool)
+        locked[edges[counts == 1].ravel()] = True
+        return locked
+
+    def neighbors(self, p: int) -> set:
+        result = set()
+        for t in self.triangles[p]:
+            result.update(int(q) for q in self.welded[t])
+        result.discard(p)
+        return result
+
+    def costs(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # errors of moving every a onto its b
+        v = np.hstack([self.positions[b], np.ones((len(b), 1))])
+        return np.einsum("ni,nij,nj->n", v, self.quadrics[a] + self.quadrics[b], v)
+
+    def push(self, heap: list, a: np.ndarray, b: np.ndarray) -> None:
+        keep = ~self.locked[a]
+        a, b = a[keep], b[keep]
+        for cost, x, y in zip(self.costs(a, b).tolist(), a.tolist(), b.tolist()):
+            heapq.heappush(heap, (cost, x, y, self.stamps[x], self.stamps[y]))
+
+    def can_collapse(self, a: int, b: int) -> bool:
+        # the link condition keeps the surface manifold, and no triangle may flip over
+        shared = [t for t in self.triangles[a] if t in self.triangles[b]]
+        if len(self.neighbors(a) & self.neighbors(b)) != len(shared):
+            return False
+        moved = [t for t in self.triangles[a] if t not in self.triangles[b]]
+        if not moved:
+            return True
+        welded = self.welded[moved]
+        p = self.positions[welded]
+        before = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+        p[welded == a] = self.positions[b]
+        after = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+        return bool(((before * after).sum(axis=1) > 1e-12 * (before * before).sum(axis=1)).all())
+
+    def collapse(self, a: int, b: int) -> int:
+        # move a onto b, return how many triangles vanished
+        removed = 0
+        for t in list(self.triangles[a]):
+            if t in self.triangles[b]:
+                self.alive[t] = False
+                removed += 1
+                for p in self.welded[t]:
+                    self.triangles[p].discard(t)
+                continue
+            k = int(np.nonzero(self.welded[t] == a)[0][0])
+            self.welded[t, k] = b
+            self.corners[t, k] = self.closest_vertex(self.corners[t, k], b)
+            self.triangles[b].add(t)
+        self.triangles[a].clear()
+        self.quadrics[b] += self.quadrics[a]
+        self.stamps[a] += 1
+        self.stamps[b] += 1
+        return removed
+
+    def closest_vertex(self, vertex: int, position: int) -> int:
+        candidates = self.split[position]
+        if len(candidates) == 1:
+            return candidates[0]
+        distance = ((self.attributes[candidates] - self.attributes[vertex]) ** 2).sum(axis=1)
+        return candidates[int(np.argmin(distance))]
+
+    def run(self, targets: list) -> list:
+        # (3 * count,) corner indices each time the live triangles reach the next target count
+        welded = self.welded[self.alive]
+        edges = np.unique(np.concatenate([welded[:, [0, 1]], welded[:, [1, 2]], welded[:, [2, 0]]]), axis=0)
+        edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+        keep = ~self.locked[edges[:, 0]]
+        costs = self.costs(edges[keep, 0], edges[keep, 1])
+        heap = [(cost, a, b, 0, 0) for cost, (a, b) in zip(costs.tolist(), edges[keep].tolist())]
+        heapq.heapify(heap)
+
+        levels = []
+        count = int(self.alive.sum())
+        for target in targets:
+            while count > target and heap:
+                _, a, b, stamp_a, stamp_b = heapq.heappop(heap)
+                if stamp_a != self.stamps[a] or stamp_b != self.stamps[b] or not self.triangles[a]:
+                    continue
+                if not self.can_collapse(a, b):
+                    continue
+                count -= self.collapse(a, b)
+                around = np.array(sorted(self.neighbors(b)), np.int64)
+                self.push(heap, around, np.full(len(around), b))
+                self.push(heap, np.full(len(around), b), around)
+            if levels and count >= len(levels[-1]) // 3:
+                # nothing more can go without tearing the surface
+                break
+            levels.append(self.corners[self.alive].ravel().copy())
+        return levels
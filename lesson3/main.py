@@ -1,4 +1,5 @@
 from camera import Camera
+from mesh_cache import MeshCache
 from rasterizer import Rasterizer
 
 I_WIDTH = 800
@@ -14,5 +15,6 @@ camera.set(
     near=1
 )
 
-rasterizer = Rasterizer(I_WIDTH, I_HEIGHT, I_SCALE, camera, "shapes.gltf")
+# the first run decodes the model into the on-disk cache, later runs map it from there
+rasterizer = Rasterizer(I_WIDTH, I_HEIGHT, I_SCALE, camera, "shapes.gltf", MeshCache())
 rasterizer.draw_primitives().show()
\ No newline at end of file
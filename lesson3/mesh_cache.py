@@ -0,0 +1,318 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from animation import is_deformed
+from gltf_loader import GltfLoader
+from texture import Texture
+from triangle import Node, Mesh, PBRMaterial, Primitive
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "builtopia_rasterizer")
+# bump when the layout of an entry changes, older entries are rebuilt
+CACHE_VERSION = 8
+STAGING_PREFIX = "staging-"
+PRIMITIVE_ARRAYS = ["vertices", "normals", "uvs", "colors", "indices", "bounds"]
+
+class MeshCache:
+    # decoded scenes on disk, one folder of .npy files per model so a warm start
+    # maps the arrays read only instead of parsing and copying anything
+    def __init__(self, folder: str = CACHE_DIR, lod: bool = False, optimize: bool = False) -> None:
+        self.folder = folder
+        # store levels of detail with every entry, entries made without them are made again
+        self.lod = lod
+        # store welded and reordered primitives, likewise
+        self.optimize = optimize
+        # animations and every file read by the last load, like GltfLoader
+        self.animations = []
+        self.files = []
+
+    def entry(self, path: str) -> str:
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.folder, key)
+
+    def load(self, path: str) -> list:
+        entry = self.entry(path)
+        manifest = self.read_manifest(entry)
+        if manifest != None and (manifest["lod"] or not self.lod) and (manifest["optimized"] or not self.optimize) and self.is_valid(entry, manifest):
+            # remember the last use for prune
+            os.utime(os.path.join(entry, "manifest.json"))
+            self.animations = []
+            self.files = [file for file, _, _ in manifest["files"]]
+            return self.read_meshes(entry, manifest)
+
+        loader = GltfLoader(self.lod, self.optimize)
+        meshes = loader.load(path)
+        self.animations = loader.animations
+        self.files = loader.files
+        # skins, morph targets and animations tie meshes to nodes and samplers the
+        # entry has no place for, so those models are always loaded from the file
+        if not loader.animations and not any(is_deformed(mesh) for mesh in meshes):
+            self.store(path, loader.files, meshes)
+        return meshes
+
+    def read_manifest(self, entry: str) -> dict:
+        try:
+            with open(os.path.join(entry, "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get("version") == CACHE_VERSION else None
+
+    def is_valid(self, entry: str, manifest: dict) -> bool:
+        # unchanged stats are trusted, otherwise the content hash decides
+        try:
+            stats = [os.stat(file) for file, _, _ in manifest["files"]]
+        except OSError:
+            return False
+        if all(s.st_mtime_ns == mtime and s.st_size == size for s, (_, mtime, size) in zip(stats, manifest["files"])):
+            return True
+        if hash_files([file for file, _, _ in manifest["files"]]) != manifest["hash"]:
+            return False
+
+        # touched but not changed, keep the entry and its new stats
+        manifest["files"] = [[file, s.st_mtime_ns, s.st_size] for (file, _, _), s in zip(manifest["files"], stats)]
+        self.write_manifest(entry, manifest)
+        return True
+
+    def store(self, path: str, files: list, meshes: list) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        # write into a fresh folder and swap it in, a crash never leaves half an entry
+        staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.folder)
+        textures, materials, primitives = [], [], []
+        manifest = {
+            "version": CACHE_VERSION,
+            "lod": self.lod,
+            "optimized": self.optimize,
+            "path": os.path.abspath(path),
+            "files": [[os.path.abspath(f), os.stat(f).st_mtime_ns, os.stat(f).st_size] for f in files],
+            "hash": hash_files(files),
+            "textures": [],
+            "materials": [],
+            "primitives": [],
+            "nodes": [],
+            "meshes": [],
+        }
+
+        # the meshes and every node above them, parents first
+        nodes = []
+        for mesh in meshes:
+            chain = []
+            node = mesh
+            while node != None and not any(node is n for n in nodes + chain):
+                chain.append(node)
+                node = node.parent
+            nodes.extend(reversed(chain))
+
+        for index, node in enumerate(nodes):
+            items = None
+            instanced = False
+            if isinstance(node, Mesh):
+                items = []
+                if node.instances is not None:
+                    np.save(os.path.join(staging, f"n{index}_instances.npy"), node.instances)
+                    instanced = True
+                for primitive in node.primitives:
+                    if not any(primitive is p for p in primitives):
+                        self.store_primitive(staging, manifest, primitive, primitives, materials, textures)
+                    items.append(next(i for i, p in enumerate(primitives) if p is primitive))
+            manifest["nodes"].append({
+                "name": node.name,
+                "parent": None if node.parent == None else next(i for i, n in enumerate(nodes) if n is node.parent),
+                "translation": [float(v) for v in node.translation],
+                "rotation": [float(v) for v in node.rotation],
+                "scale": [float(v) for v in node.scale],
+                "matrix": None if node.matrix is None else node.matrix.tolist(),
+                "primitives": items,
+                "instanced": instanced,
+            })
+        manifest["meshes"] = [next(i for i, n in enumerate(nodes) if n is mesh) for mesh in meshes]
+
+        self.write_manifest(staging, manifest)
+        entry = self.entry(path)
+        # an older entry is renamed away first, removing it in place is not atomic and
+        # other processes may be storing the same model at the same time
+        old = staging + "-old"
+        try:
+            os.replace(entry, old)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(staging, entry)
+        except OSError:
+            # another process put its entry there in between, it is as good as ours
+            shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def store_primitive(self, folder: str, manifest: dict, primitive: Primitive, primitives: list, materials: list, textures: list) -> None:
+        index = len(primitives)
+        primitives.append(primitive)
+        for name in PRIMITIVE_ARRAYS:
+            np.save(os.path.join(folder, f"p{index}_{name}.npy"), np.asarray(getattr(primitive, name)))
+        for level, indices in enumerate(primitive.lods or []):
+            np.save(os.path.join(folder, f"p{index}_lod{level}.npy"), indices)
+
+        material = primitive.material
+        if not any(material is m for m in materials):
+            texture = material.texture
+            if texture != None and not any(texture is t for t in textures):
+                np.save(os.path.join(folder, f"t{len(textures)}.npy"), texture.texels)
+                manifest["textures"].append({"mag_filter": texture.mag_filter, "wrap_s": texture.wrap_s, "wrap_t": texture.wrap_t})
+                textures.append(texture)
+            materials.append(material)
+            manifest["materials"].append({
+                "color": [int(c) for c in material.color],
+                "double_sided": material.double_sided,
+                "metallic": material.metallic,
+                "roughness": material.roughness,
+                "texture": None if texture == None else next(i for i, t in enumerate(textures) if t is texture),
+            })
+        manifest["primitives"].append({
+            "material": next(i for i, m in enumerate(materials) if m is material),
+            "lods": None if primitive.lods == None else len(primitive.lods),
+        })
+
+    def read_meshes(self, entry: str, manifest: dict) -> list:
+        def read(name: str) -> np.ndarray:
+            return np.load(os.path.join(entry, name), mmap_mode="r")
+
+        textures = []
+        for i, t in enumerate(manifest["textures"]):
+            textures.append(Texture(read(f"t{i}.npy"), t["mag_filter"], t["wrap_s"], t["wrap_t"]))
+
+        materials = []
+        for m in manifest["materials"]:
+            material = PBRMaterial()
+            material.color = m["color"]
+            material.double_sided = m["double_sided"]
+            material.metallic = m["metallic"]
+            material.roughness = m["roughness"]
+            material.texture = None if m["texture"] == None else textures[m["texture"]]
+            materials.append(material)
+
+        primitives = []
+        for i, item in enumerate(manifest["primitives"]):
+            p = Primitive()
+            for name in PRIMITIVE_ARRAYS:
+                setattr(p, name, read(f"p{i}_{name}.npy"))
+            p.material = materials[item["material"]]
+            if item["lods"] != None:
+                p.lods = [read(f"p{i}_lod{level}.npy") for level in range(item["lods"])]
+            primitives.append(p)
+
+        nodes = []
+        for index, n in enumerate(manifest["nodes"]):
+            node = Node() if n["primitives"] == None else Mesh()
+            node.name = n["name"]
+            node.set_translation(n["translation"])
+            node.set_rotation(n["rotation"])
+            node.set_scale(n["scale"])
+            if n["matrix"] != None:
+                node.matrix = np.array(n["matrix"])
+            if n["primitives"] != None:
+                node.primitives = [primitives[i] for i in n["primitives"]]
+            if n["instanced"]:
+                node.instances = read(f"n{index}_instances.npy")
+            if n["parent"] != None:
+                nodes[n["parent"]].add_child(node)
+            nodes.append(node)
+        return [nodes[i] for i in manifest["meshes"]]
+
+    def write_manifest(self, folder: str, manifest: dict) -> None:
+        with open(os.path.join(folder, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+    def entries(self) -> list:
+        if not os.path.isdir(self.folder):
+            return []
+        return [os.path.join(self.folder, name) for name in os.listdir(self.folder)
+            if not name.startswith(STAGING_PREFIX) and os.path.isfile(os.path.join(self.folder, name, "manifest.json"))]
+
+    def invalidate(self, path: str) -> None:
+        shutil.rmtree(self.entry(path), ignore_errors=True)
+
+    def prune(self, max_bytes: int = None, max_age: float = None) -> int:
+        # drop entries whose model is gone, unused for max_age seconds,
+        # then the least recently used ones until the cache fits in max_bytes
+        if os.path.isdir(self.folder):
+            # folders left behind by an interrupted store
+            for name in os.listdir(self.folder):
+                if name.startswith(STAGING_PREFIX):
+                    shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+
+        entries = []
+        for entry in self.entries():
+            manifest = self.read_manifest(entry)
+            used = os.path.getmtime(os.path.join(entry, "manifest.json"))
+            stale = manifest == None or not os.path.exists(manifest["path"])
+            if stale or (max_age != None and time.time() - used > max_age):
+                shutil.rmtree(entry, ignore_errors=True)
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((used, size, entry))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while max_bytes != None and total > max_bytes and entries:
+            _, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return total
+
+    def clear(self) -> None:
+        for entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def warm(self, folder: str) -> list:
+        # load every model under a folder once so later runs start from the cache
+        warmed = []
+        for root, _, names in os.walk(folder):
+            for name in sorted(names):
+                if name.endswith((".gltf", ".glb")):
+                    path = os.path.join(root, name)
+                    try:
+                        self.load(path)
+                    except Exception as e:
+                        # one broken model must not stop the rest from being cached
+                        print("failed to cache %s: %s: %s" % (path, type(e).__name__, e))
+                        continue
+                    warmed.append(path)
+        return warmed
+
+def hash_files(files: list) -> str:
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="manage the preprocessed mesh cache")
+    parser.add_argument("--cache", default=CACHE_DIR, help="cache folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("warm", help="cache every .gltf and .glb under the given folders")
+    warm.add_argument("folders", nargs="+")
+    warm.add_argument("--lod", action="store_true", help="also build and store levels of detail")
+    warm.add_argument("--optimize", action="store_true", help="weld vertices and reorder triangles for locality, with smaller indices")
+    prune = commands.add_parser("prune", help="drop stale and least recently used entries")
+    prune.add_argument("--max-mb", type=float, default=None)
+    prune.add_argument("--max-days", type=float, default=None)
+    commands.add_parser("clear", help="drop every entry")
+    args = parser.parse_args()
+
+    warming = args.command == "warm"
+    cache = MeshCache(args.cache, warming and args.lod, warming and args.optimize)
+    if args.command == "warm":
+        for folder in args.folders:
+            for path in cache.warm(folder):
+                print("cached", path)
+    elif args.command == "prune":
+        max_bytes = None if args.max_mb == None else int(args.max_mb * 1024 * 1024)
+        max_age = None if args.max_days == None else args.max_days * 24 * 3600
+        print("cache size", cache.prune(max_bytes, max_age), "bytes")
+    else:
+        cache.clear()
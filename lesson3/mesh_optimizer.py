@@ -0,0 +1,147 @@
+import argparse
+import numpy as np
+from triangle import Primitive
+
+# post transform cache the triangle order is tuned for, in vertices
+VERTEX_CACHE_SIZE = 16
+# per vertex arrays of a primitive, in the order they are welded on
+VERTEX_ARRAYS = ["vertices", "normals", "uvs", "colors", "joints", "skin_weights"]
+
+def optimize_primitive(primitive: Primitive, cache_size: int = VERTEX_CACHE_SIZE) -> None:
+    # weld identical vertices, order the triangles for a vertex cache, store the vertices
+    # in the order the triangles first use them and keep the indices in the smallest dtype;
+    # the primitive draws the same triangles afterwards, only its arrays are replaced
+    indices = np.asarray(primitive.indices, np.int64)
+    if len(indices) == 0:
+        return
+    remap = weld_vertices(primitive)
+    triangles = remap[indices].reshape(-1, 3)
+    order = tipsify(triangles, len(primitive.vertices), cache_size)
+    triangles = triangles[order]
+
+    # vertices in order of first use, ones no triangle uses are dropped
+    used, first = np.unique(triangles.ravel(), return_index=True)
+    vertex_order = used[np.argsort(first)]
+    new_index = np.full(len(primitive.vertices), -1, np.int64)
+    new_index[vertex_order] = np.arange(len(vertex_order))
+
+    # old vertex -> new vertex, for the vertex arrays and every index buffer
+    moved = new_index[remap]
+    source = np.zeros(len(vertex_order), np.int64)
+    source[moved[moved >= 0]] = np.nonzero(moved >= 0)[0]
+    for name in VERTEX_ARRAYS:
+        values = getattr(primitive, name)
+        if len(values):
+            setattr(primitive, name, np.ascontiguousarray(np.asarray(values)[source]))
+    for name in ("targets", "target_normals"):
+        values = getattr(primitive, name)
+        if len(values):
+            setattr(primitive, name, np.ascontiguousarray(np.asarray(values)[:, source]))
+
+    dtype = index_dtype(len(vertex_order))
+    primitive.indices = new_index[triangles.ravel()].astype(dtype)
+    if primitive.lods != None:
+        primitive.lods = [moved[np.asarray(lod, np.int64)].astype(dtype) for lod in primitive.lods]
+
+def weld_vertices(primitive: Primitive) -> np.ndarray:
+    # (N,) index of the first vertex with exactly the same attributes as each vertex
+    count = len(primitive.vertices)
+    columns = [np.asarray(getattr(primitive, name)).reshape(count, -1) for name in VERTEX_ARRAYS if len(getattr(primitive, name))]
+    for name in ("targets", "target_normals"):
+        values = getattr(primitive, name)
+        if len(values):
+            columns.append(np.asarray(values).transpose(1, 0, 2).reshape(count, -1))
+    # every attribute as raw bytes, so one row compares a whole vertex
+    rows = np.hstack([np.ascontiguousarray(c).view(np.uint8).reshape(count, -1) for c in columns])
+    rows = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return first[inverse.ravel()]
+
+def index_dtype(count: int) -> np.dtype:
+    if count <= 1 << 8:
+        return np.uint8
+    if count <= 1 << 16:
+        return np.uint16
+    return np.uint32
+
+def tipsify(triangles: np.ndarray, vertex_count: int, cache_size: int = VERTEX_CACHE_SIZE) -> np.ndarray:
+    # triangle order of Tipsify (Sander, Nehab and Barczak 2007): fan around one vertex at a time,
+    # next the vertex that will still be in the cache with triangles left, else a recent dead end
+    count = len(triangles)
+    corners = triangles.ravel()
+    # triangles around every vertex, as slices of one sorted array
+    around = np.argsort(corners, kind="stable") // 3
+    starts = np.zeros(vertex_count + 1, np.int64)
+    np.cumsum(np.bincount(corners, minlength=vertex_count), out=starts[1:])
+    around, starts = around.tolist(), starts.tolist()
+    live = np.bincount(corners, minlength=vertex_count).tolist()
+    triangles = triangles.tolist()
+
+    cache_time = [0] * vertex_count
+    emitted = [False] * count
+    dead_ends = []
+    order = []
+    time = cache_size + 1
+    cursor = 0
+    fan = 0 if count else -1
+    while fan >= 0:
+        candidates = []
+        for t in around[starts[fan]:starts[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangles[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - cache_time[v] > cache_size:
+                    cache_time[v] = time
+                    time += 1
+
+        # the candidate in the cache the longest that will still be there after its fan
+        fan, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = time - cache_time[v] if time - cache_time[v] + 2 * live[v] <= cache_size else 0
+                if priority > best:
+                    fan, best = v, priority
+        if fan < 0:
+            while dead_ends and fan < 0:
+                v = dead_ends.pop()
+                if live[v] > 0:
+                    fan = v
+            while fan < 0 and cursor < vertex_count:
+                if live[cursor] > 0:
+                    fan = cursor
+                cursor += 1
+    return np.array(order, np.int64)
+
+def cache_miss_ratio(indices: np.ndarray, cache_size: int = VERTEX_CACHE_SIZE) -> float:
+    # vertices transformed per triangle by a FIFO post transform cache, 3 is no reuse at all
+    cache = []
+    misses = 0
+    for v in np.asarray(indices).tolist():
+        if v not in cache:
+            misses += 1
+            cache.append(v)
+            if len(cache) > cache_size:
+                cache.pop(0)
+    return misses / max(len(indices) // 3, 1)
+
+if __name__ == "__main__":
+    from gltf_loader import GltfLoader
+    parser = argparse.ArgumentParser(description="report what optimize_primitive does to the primitives of a model")
+    parser.add_argument("file")
+    args = parser.parse_args()
+
+    seen = set()
+    for mesh in GltfLoader().load(args.file):
+        for primitive in mesh.primitives:
+            if id(primitive) in seen:
+                continue
+            seen.add(id(primitive))
+            before = (len(primitive.vertices), cache_miss_ratio(primitive.indices), np.asarray(primitive.indices).nbytes)
+            optimize_primitive(primitive)
+            after = (len(primitive.vertices), cache_miss_ratio(primitive.indices), primitive.indices.nbytes)
+            print("%-30s vertices %6d -> %6d  acmr %.2f -> %.2f  index bytes %7d -> %7d" % ((mesh.name,) + sum(zip(before, after), ())))
@@ -0,0 +1,54 @@
+import argparse
+import time
+import numpy as np
+from camera import Camera
+from lighting import UNLIT, LAMBERT, BLINN_PHONG, PBR
+from mesh_cache import MeshCache
+from rasterizer import Rasterizer
+from sequence import orbit_path
+from tile_rasterizer import TileRasterizer
+
+I_WIDTH = 800
+I_HEIGHT = 600
+I_SCALE = 200
+
+# orbit the camera around a model, loading it once and re-rendering only what the camera changes
+parser = argparse.ArgumentParser(description="orbit the camera around a model and report the frame rate")
+parser.add_argument("file", nargs="?", default="shapes.gltf")
+parser.add_argument("--frames", type=int, default=36)
+parser.add_argument("--radius", type=float, default=3.7)
+parser.add_argument("--cache", action="store_true", help="load through the on-disk mesh cache")
+parser.add_argument("--shading", default=UNLIT, choices=[UNLIT, LAMBERT, BLINN_PHONG, PBR])
+parser.add_argument("--deferred", action="store_true", help="shade each visible pixel once from a G-buffer")
+parser.add_argument("--lod", action="store_true", help="draw small and far away meshes with fewer triangles")
+parser.add_argument("--tiles", action="store_true", help="draw screen tiles on a pool of worker processes")
+parser.add_argument("--save", help="write the last frame to this image")
+args = parser.parse_args()
+
+def orbit(rasterizer: Rasterizer) -> tuple:
+    # times of every frame and the last image
+    rasterizer.shading = args.shading
+    rasterizer.deferred = args.deferred
+    times = []
+    for params in orbit_path(args.frames, args.radius):
+        camera.set(**params)
+        start = time.perf_counter()
+        image = rasterizer.draw_primitives()
+        times.append(time.perf_counter() - start)
+    return times, image
+
+camera = Camera()
+camera.set(position=[1, 2, 3], look_at=[0, 0, 0], up=[0, 1, 0], fovy=45, near=1)
+# levels of detail are built with the model, and kept in the cache entry
+cache = MeshCache(lod=args.lod) if args.cache else None
+if args.tiles:
+    # the workers and shared frame buffers are released when the orbit is done
+    with TileRasterizer(I_WIDTH, I_HEIGHT, I_SCALE, camera, args.file, cache, args.lod) as rasterizer:
+        times, image = orbit(rasterizer)
+else:
+    times, image = orbit(Rasterizer(I_WIDTH, I_HEIGHT, I_SCALE, camera, args.file, cache, args.lod))
+
+times = np.array(times)
+print("%d frames, %.1f ms mean, %.1f ms worst, %.1f fps" % (len(times), 1000 * times.mean(), 1000 * times.max(), 1 / times.mean()))
+if args.save:
+    image.save(args.save)
@@ -1,131 +1,654 @@
-from turtle import width
+import math
 import numpy as np
 from PIL import Image
 from gltf_loader import GltfLoader
+from mesh_cache import MeshCache
 from camera import Camera
-from triangle import Vertice, Triangle
+from triangle import Vertice, Triangle, Mesh, Primitive, PBRMaterial
 from depth_manager import DepthManager
+from gbuffer import GBuffer
+from culler import Culler
+from stage_timer import StageTimer
+from animation import pose_mesh
+from bvh import BVH, transform_bounds, intersect_triangles
+from lod import build_lods
+from lighting import UNLIT, LAMBERT, BLINN_PHONG, DirectionalLight, normalize, to_linear, to_srgb, shade_lambert, shade_blinn_phong, shade_pbr
+
+# upper bound of candidate pixels tested at once by the fill engines
+CHUNK_PIXELS = 1 << 20
+# screen area per triangle a level of detail aims for at most
+LOD_TRIANGLE_PIXELS = 8
+# fill engines, edge functions over bounding boxes or scanline spans
+FILL_EDGES = "edges"
+FILL_SCANLINE = "scanline"
+# antialiasing modes: coverage and depth per sample but one shade per pixel, or everything per sample
+AA_MSAA = "msaa"
+AA_SSAA = "ssaa"
+AA_SAMPLES = 4
 
 class Rasterizer:
-    def __init__(self, width: int, height: int, scale: int, camera: Camera, file: str) -> None:
+    def __init__(self, width: int, height: int, scale: int, camera: Camera, file: str, cache: MeshCache = None, lod: bool = False) -> None:
         self.width = width
         self.height = height
         self.scale = scale
+        # size of the image; width, height and scale are those of the sample grid frames are drawn on,
+        # factor times larger per side when antialiased
+        self.image_width = width
+        self.image_height = height
+        self.image_scale = scale
+        self.antialias = None
+        self.factor = 1
         self.camera = camera
-        loader = GltfLoader()
+        # decoded arrays come from the on-disk cache when one is given
+        loader = cache if cache != None else GltfLoader(lod)
         self.meshes = loader.load(file)
+        self.animations = loader.animations
+        if lod:
+            self.prepare_lods()
+        self.allocate_buffers()
+        self.timer = StageTimer()
+        # fill engine and shading model of the next renders
+        self.fill = FILL_EDGES
+        self.shading = UNLIT
+        self.lights = [DirectionalLight([-1, -2, -3])]
+        self.ambient = 0.1
+        # deferred renders shade each visible pixel once, after all the geometry is in the G-buffer
+        self.deferred = False
+        # skip primitives and triangles hidden behind what is already drawn, helped by
+        # drawing the nearest primitives first or by laying down all the depths first
+        self.occlusion = True
+        self.front_to_back = False
+        self.depth_prepass = False
+        # set while the color pass after a depth pre-pass runs
+        self.depth_equal = False
+        # draw far away primitives with fewer triangles; their levels are built when the model is loaded
+        # with lod, a primitive without them is always drawn in full
+        self.lod = lod
+        # [x, y, z, 1] vertices of every primitive, built once and reused by every frame
+        self.homogeneous = {}
+        self.build_bvh()
+
+    def allocate_buffers(self) -> None:
+        # frame buffers of the sample grid; the G-buffer is made by the first deferred render
         self.color_map = np.zeros((self.height, self.width, 3), np.uint8)
-        self.depth_manager = DepthManager(width, height)
+        self.depth_manager = DepthManager(self.width, self.height)
+        self.culler = Culler(self.width, self.height)
+        self.gbuffer = None
 
-    def draw_primitives(self) -> Image:
+    def set_antialias(self, mode: str, samples: int = AA_SAMPLES) -> None:
+        # None draws a sample per pixel, AA_MSAA and AA_SSAA an ordered grid of samples per pixel,
+        # so samples is a square number; deferred renders shade every sample in both modes
+        factor = 1 if mode == None else math.isqrt(samples)
+        if mode not in (None, AA_MSAA, AA_SSAA) or (mode != None and (factor < 2 or factor * factor != samples)):
+            raise ValueError("unsupported antialiasing %s with %d samples" % (mode, samples))
+        self.antialias = mode
+        self.factor = factor
+        self.width = self.image_width * factor
+        self.height = self.image_height * factor
+        self.scale = self.image_scale * factor
+        self.allocate_buffers()
+
+    def prepare_lods(self) -> None:
+        # levels of detail of the primitives a cache handed over without them, before the first frame
         for mesh in self.meshes:
             for primitive in mesh.primitives:
-                translation = mesh.translation
-                scale = mesh.scale
-                vertices = primitive.vertices
-                processed = []
-                for v in vertices:
-                    v1 = [v[0] * scale[0] + translation[0],
-                        v[1] * scale[1] + translation[1],
-                        v[2] * scale[2] + translation[2]]
-                    processed.append(v1)
-                    
-                positions = self.generate_pixel_positions(processed)
+                if primitive.lods == None:
+                    primitive.lods = build_lods(primitive)
+
+    def build_bvh(self) -> None:
+        # spatial index over every instance of every primitive in world space, rebuilt by the
+        # next frame when a node moves; item i is drawn by self.items[i] with self.matrices[i]
+        self.items = []
+        # node versions the matrices were taken at
+        self.versions = [mesh.version for mesh in self.meshes]
+        matrices = []
+        bounds = []
+        for mesh in self.meshes:
+            instances = self.get_instances(mesh)
+            for primitive in mesh.get_primitives():
+                self.items += [(mesh, primitive)] * len(instances)
+                matrices.append(instances)
+                bounds.append(transform_bounds(primitive.bounds, instances))
+        self.matrices = np.concatenate(matrices) if matrices else np.zeros((0, 4, 4))
+        self.bvh = BVH(np.concatenate(bounds) if bounds else np.zeros((0, 2, 3)))
+
+    def get_instances(self, mesh: Mesh) -> np.ndarray:
+        # (M, 4, 4) world matrices of every copy a mesh draws, skinning already puts skinned meshes in world space
+        world = np.eye(4) if mesh.skin != None else mesh.get_matrix()
+        if mesh.instances is None:
+            return world[None]
+        return world @ mesh.instances
+
+    def batch_items(self, items: np.ndarray) -> list:
+        # group items drawing the same primitive at the same level of detail, every group is one
+        # instanced draw; groups keep the order of their first item and items their order within a group
+        levels = self.lod_levels(items) if self.lod else np.zeros(len(items), np.int64)
+        groups = {}
+        for i, level in zip(items, levels):
+            groups.setdefault((id(self.items[i][1]), int(level)), []).append(i)
+        return [(self.items[group[0]][1], level, np.array(group)) for (_, level), group in groups.items()]
+
+    def lod_levels(self, items: np.ndarray) -> np.ndarray:
+        # the finest level of every item with no more than one triangle per LOD_TRIANGLE_PIXELS
+        # of the area its bounding sphere covers on screen, level 0 draws primitive.indices
+        bounds = self.bvh.bounds[items]
+        radius = np.sqrt(((bounds[:, 1] - bounds[:, 0])**2).sum(axis=1)) / 2
+        distance = np.sqrt(((bounds.mean(axis=1) - self.camera.position)**2).sum(axis=1))
+        # image pixels per world unit at distance 1
+        focal = self.image_scale * np.linalg.norm(self.camera.get_perspective()[0, :3])
+        pixels = focal * radius / np.maximum(distance, 1e-6)
+        budget = np.where(distance > radius, np.pi * pixels**2 / LOD_TRIANGLE_PIXELS, np.inf)
+
+        levels = np.zeros(len(items), np.int64)
+        for n, i in enumerate(items):
+            primitive = self.items[i][1]
+            counts = [len(primitive.indices)] + [len(lod) for lod in primitive.lods or []]
+            fits = [level for level, count in enumerate(counts) if count // 3 <= budget[n]]
+            levels[n] = fits[0] if fits else len(counts) - 1
+        return levels
+
+    def visible_primitives(self) -> list:
+        # (mesh, primitive) pairs whose bounds touch the view frustum
+        return [self.items[i] for i in self.visible_items()]
+
+    def visible_items(self) -> np.ndarray:
+        # indices into self.items in the frustum, nearest box first when front_to_back is set
+        moved = [mesh.version for mesh in self.meshes] != self.versions
+        with self.timer.stage("animate"):
+            posed = [pose_mesh(mesh) for mesh in self.meshes]
+        if moved or any(posed):
+            self.build_bvh()
+        items = self.bvh.query_frustum(self.get_frustum_planes())
+        if self.front_to_back:
+            items = self.sort_front_to_back(items)
+        return items
+
+    def sort_front_to_back(self, items: np.ndarray) -> np.ndarray:
+        # nearest box first, boxes the eye is inside of by their centers
+        if len(items) == 0:
+            return items
+        eye = np.asarray(self.camera.position, np.float64)
+        bounds = self.bvh.bounds[items]
+        nearest = np.clip(eye, bounds[:, 0], bounds[:, 1])
+        distance = np.sqrt(((nearest - eye)**2).sum(axis=1))
+        center = np.sqrt(((bounds.mean(axis=1) - eye)**2).sum(axis=1))
+        return items[np.lexsort((center, distance))]
+
+    def occlusion_waves(self, items: np.ndarray) -> list:
+        # the items front to back in runs of 1, 2, 4, ... items; every run is drawn as instanced
+        # batches, and the nearer runs drawn before it are what its instances are tested against
+        items = self.sort_front_to_back(items)
+        return [items[(1 << k) - 1:(2 << k) - 1] for k in range(len(items).bit_length())]
+
+    def box_occluded(self, bounds: np.ndarray) -> bool:
+        # whether a (2, 3) world box is behind everything drawn over its screen rectangle
+        corners = np.array(np.meshgrid(*bounds.T, indexing="ij")).reshape(3, -1).T
+        camera_pos = np.hstack([corners, np.ones((8, 1))]) @ self.camera.get_perspective().transpose()
+        if (camera_pos[:, 3] < self.camera.near).any():
+            return False
+        px = (camera_pos[:, 0] / camera_pos[:, 3] * self.scale + self.width/2).astype(np.int64)
+        py = (-camera_pos[:, 1] / camera_pos[:, 3] * self.scale + self.height/2).astype(np.int64)
+        x0, x1 = max(px.min(), 0), min(px.max(), self.width - 1)
+        y0, y1 = max(py.min(), 0), min(py.max(), self.height - 1)
+        if x0 > x1 or y0 > y1:
+            return False
+        nearest = camera_pos[:, 2].max()
+        return bool(self.depth_manager.occluded(*(np.array([v]) for v in (x0, y0, x1, y1, nearest)))[0])
+
+    def get_frustum_planes(self) -> np.ndarray:
+        # world space planes of everything that lands on the canvas in front of the near plane,
+        # a point p is inside when plane . [p, 1] >= 0 for every plane
+        matrix = self.camera.get_perspective()
+        x, y, w = matrix[0], matrix[1], matrix[3]
+        kx = self.width / (2 * self.scale)
+        ky = self.height / (2 * self.scale)
+        return np.array([w - [0, 0, 0, self.camera.near], kx*w - x, kx*w + x, ky*w - y, ky*w + y])
+
+    def pick(self, x: float, y: float) -> Mesh:
+        # the mesh seen at a canvas position, or None
+        x, y = x * self.factor, y * self.factor
+        view = np.linalg.inv(self.camera.get_orthographic())
+        ndc_x = (x - self.width/2) / self.scale
+        ndc_y = -(y - self.height/2) / self.scale
+        ray = [ndc_x * self.camera.width / (2 * self.camera.near), ndc_y * self.camera.height / (2 * self.camera.near), -1]
+        origin, direction = view[:3, 3], view[:3, :3] @ ray
+
+        best, picked = np.inf, None
+        items, distances = self.bvh.query_ray(origin, direction)
+        for item, distance in zip(items, distances):
+            # boxes come nearest first, nothing further can beat the best hit
+            if distance > best:
+                break
+            mesh, primitive = self.items[item]
+            matrix = self.matrices[item]
+            vertices = primitive.vertices @ matrix[:3, :3].T + matrix[:3, 3]
+            a, b, c = vertices[np.asarray(primitive.indices).reshape(-1, 3)].transpose(1, 0, 2)
+            hit = intersect_triangles(origin, direction, a, b, c).min(initial=np.inf)
+            if hit < best:
+                best, picked = hit, mesh
+        return picked
+
+    def clear(self) -> None:
+        # reset the frame buffers in place, so a frame allocates nothing for them
+        self.color_map.fill(0)
+        self.depth_manager.clear()
+
+    def draw_primitives(self) -> Image:
+        # safe to call again after a camera change, every frame starts from empty buffers
+        self.clear()
+        self.culler.reset()
+        self.timer.reset()
+        if self.deferred:
+            if self.gbuffer == None:
+                self.gbuffer = GBuffer(self.width, self.height)
+            self.gbuffer.clear()
+        items = self.visible_items()
+        if self.depth_prepass:
+            # depths of everything first, then only the nearest fragment of each pixel is shaded
+            batches = self.batch_items(items)
+            prepared = [self.prepare_primitive(primitive, self.matrices[group], level) for primitive, level, group in batches]
+            for positions, indices, _ in prepared:
+                self.draw_triangles(positions, indices, {}, None, depth_only=True)
+            self.depth_equal = True
+            for (primitive, level, group), (positions, indices, varyings) in zip(batches, prepared):
+                if self.occlusion:
+                    # batches with every instance behind the laid down depths are skipped
+                    hidden = np.array([self.box_occluded(self.bvh.bounds[i]) for i in group])
+                    self.timer.count("occluded_primitives", int(hidden.sum()))
+                    if hidden.all():
+                        continue
                 self.depth_manager.calc_depth_ratio()
-                indices = primitive.indices
-                uvs = primitive.uvs
+                self.draw_triangles(positions, indices, varyings, primitive.material)
+            self.depth_equal = False
+        else:
+            for wave in self.occlusion_waves(items) if self.occlusion else [items]:
+                if self.occlusion:
+                    # instances hidden by the waves drawn before this one are dropped before they are grouped
+                    hidden = np.array([self.box_occluded(self.bvh.bounds[i]) for i in wave], bool)
+                    self.timer.count("occluded_primitives", int(hidden.sum()))
+                    wave = wave[~hidden]
+                for primitive, level, group in self.batch_items(wave):
+                    positions, indices, varyings = self.prepare_primitive(primitive, self.matrices[group], level)
+                    self.depth_manager.calc_depth_ratio()
+                    self.draw_triangles(positions, indices, varyings, primitive.material)
+
+        if self.deferred:
+            self.resolve()
+        return Image.fromarray(self.downsample(), 'RGB')
+
+    def downsample(self) -> np.ndarray:
+        # average every factor x factor block of samples into its pixel; MSAA keeps a color
+        # per sample as well, so this box filter is the resolve of both modes
+        factor = self.factor
+        if factor == 1:
+            return self.color_map
+        with self.timer.stage("downsample"):
+            # one strided view per sample position, much faster than summing a 5d reshape
+            sums = np.zeros((self.image_height, self.image_width, 3), np.uint32)
+            for i in range(factor):
+                for j in range(factor):
+                    sums += self.color_map[i::factor, j::factor]
+            return ((sums + factor * factor // 2) // (factor * factor)).astype(np.uint8)
+
+    def resolve(self) -> None:
+        # shade every visible pixel once from the G-buffer, one batch per shader
+        with self.timer.stage("shade"):
+            ys, xs = np.nonzero(self.gbuffer.shader >= 0)
+            shaders = self.gbuffer.shader[ys, xs]
+            self.timer.count("shaded", len(xs))
+            for shader, (material, names) in enumerate(self.gbuffer.shaders):
+                pick = np.nonzero(shaders == shader)[0]
+                px, py = xs[pick], ys[pick]
+                fragments = self.gbuffer.read(px, py, names)
+                if "world" in names:
+                    fragments["world"] = self.unproject(px, py, self.depth_manager.depth_map[py, px])
+                self.color_map[py, px] = self.shade(material, fragments, len(pick), faced=True)
+
+    def report_overdraw(self) -> dict:
+        # of the last frame: fragments covered, written past the depth test and shaded
+        # per visible pixel, deferred renders shade each pixel once however often it was written
+        counters = self.timer.counters
+        pixels = int(np.count_nonzero(self.depth_manager.depth_map > float("-inf")))
+        per_pixel = lambda name: counters.get(name, 0) / pixels if pixels else 0.0
+        return {
+            "pixels": pixels,
+            "depth_complexity": per_pixel("fragments"),
+            "overdraw": per_pixel("written"),
+            "shading_rate": per_pixel("shaded"),
+        }
+
+    def report_buffers(self) -> dict:
+        # bytes of the frame buffers, antialiased frames need them for every sample;
+        # the G-buffer only holds the varyings deferred renders have written so far
+        depth = self.depth_manager
+        gbuffer = self.gbuffer
+        return {
+            "samples": self.factor * self.factor,
+            "color": self.color_map.nbytes,
+            "depth": depth.depth_map.nbytes + depth.passed.nbytes + sum(level.nbytes for level in depth.pyramid),
+            "gbuffer": 0 if gbuffer == None else gbuffer.shader.nbytes + sum(v.nbytes for v in gbuffer.varyings.values()),
+        }
+
+    def unproject(self, xs: np.ndarray, ys: np.ndarray, depths: np.ndarray) -> np.ndarray:
+        # (N, 3) world positions of pixels at a view depth, generate_pixel_positions backwards
+        camera = self.camera
+        w = -np.asarray(depths, np.float64)
+        x = (xs - self.width/2) / self.scale * w * camera.width / (2 * camera.near)
+        y = -(ys - self.height/2) / self.scale * w * camera.height / (2 * camera.near)
+        view = np.stack([x, y, -w, np.ones(len(w))], axis=1)
+        return (view @ np.linalg.inv(camera.get_orthographic()).transpose())[:, :3]
+
+    def prepare_primitive(self, primitive: Primitive, model_matrix: np.ndarray, level: int = 0) -> tuple:
+        # transform, clip and cull a primitive, return what is left to be filled
+        # and the per vertex varyings its shading needs; a (M, 4, 4) model_matrix
+        # draws M instances at once, as one primitive with M copies of the vertices,
+        # and a level above 0 draws the index buffer of that level of detail
+        matrices = np.reshape(model_matrix, (-1, 4, 4))
+        with self.timer.stage("transform"):
+            camera_pos = self.transform_vertices(self.get_homogeneous(primitive), matrices)
+            varyings = self.get_varyings(primitive, matrices)
+            indices = self.instance_indices(primitive, matrices, primitive.indices if level == 0 else primitive.lods[level - 1])
+        with self.timer.stage("cull"):
+            camera_pos, indices, lerp = self.culler.clip_near(camera_pos, indices, self.camera.near)
+        with self.timer.stage("transform"):
+            positions = self.generate_pixel_positions(camera_pos)
+        with self.timer.stage("cull"):
+            indices = self.culler.cull(positions, indices, primitive.material.double_sided)
+            varyings = {name: self.culler.interpolate(values, lerp) for name, values in varyings.items()}
+        self.timer.count("triangles", len(indices) // 3)
+        return positions, indices, varyings
+
+    def get_varyings(self, primitive: Primitive, matrices: np.ndarray) -> dict:
+        # (M * N, k) per vertex attributes by name for M (4, 4) model matrices, only the ones shade reads
+        varyings = {}
+        copies = len(matrices)
+        if primitive.material.texture != None and len(primitive.uvs):
+            varyings["uv"] = primitive.uvs if copies == 1 else np.tile(primitive.uvs, (copies, 1))
+        if len(primitive.colors):
+            varyings["color"] = primitive.colors if copies == 1 else np.tile(primitive.colors, (copies, 1))
+        if self.shading != UNLIT and len(primitive.normals):
+            # world space normals through the cofactor matrix, the inverse transpose times the
+            # determinant, so zero scaled nodes need no inverse; the sign keeps mirrored normals
+            # pointing out, and the largest entry is scaled to 1 so float16 G-buffers hold them
+            a = matrices[:, :3, :3]
+            cofactors = np.stack([np.cross(a[:, :, 1], a[:, :, 2]), np.cross(a[:, :, 2], a[:, :, 0]), np.cross(a[:, :, 0], a[:, :, 1])], axis=1)
+            sizes = np.abs(cofactors).max(axis=(1, 2), initial=0) * np.where(np.linalg.det(a) < 0, -1, 1)
+            normal_matrices = cofactors / np.where(sizes == 0, 1, sizes)[:, None, None]
+            varyings["normal"] = (primitive.normals @ normal_matrices).reshape(-1, 3)
+            varyings["world"] = (self.get_homogeneous(primitive) @ matrices[:, :3].transpose(0, 2, 1)).reshape(-1, 3)
+        return varyings
+
+    def instance_indices(self, primitive: Primitive, matrices: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        # indices of M copies of a primitive, each into its own block of vertices; mirrored
+        # instances get their triangles reversed so back faces are still culled correctly
+        if len(matrices) == 1 and np.linalg.det(matrices[0, :3, :3]) >= 0:
+            return indices
+        triangles = np.asarray(indices, np.int64).reshape(-1, 3)
+        mirrored = np.linalg.det(matrices[:, :3, :3]) < 0
+        copies = np.where(mirrored[:, None, None], triangles[:, ::-1], triangles)
+        copies = copies + (np.arange(len(matrices)) * len(primitive.vertices))[:, None, None]
+        return copies.ravel()
 
-                color = primitive.material.color
-                if primitive.material.texture != None:
-                    self.draw_triangles_with_texture(positions, indices, uvs, primitive.material.texture)
+    def get_homogeneous(self, primitive: Primitive) -> np.ndarray:
+        # rebuilt when a pose gave the primitive new vertices
+        key = id(primitive)
+        vertices = primitive.vertices
+        if key not in self.homogeneous or self.homogeneous[key][0] is not vertices:
+            self.homogeneous[key] = (vertices, np.hstack([vertices, np.ones((len(vertices), 1), vertices.dtype)]))
+        return self.homogeneous[key][1]
+
+    def transform_vertices(self, homogeneous: np.ndarray, model_matrix: np.ndarray) -> np.ndarray:
+        # transform all the vertices at once, [x, y, z, 1] -> [x', y', z', -z'],
+        # by a (M, 4, 4) model_matrix the M copies come one after the other
+        matrix = np.matmul(self.camera.get_perspective(), model_matrix)
+        if matrix.ndim == 2:
+            return homogeneous @ matrix.transpose()
+        return (homogeneous @ matrix.transpose(0, 2, 1)).reshape(-1, 4)
+
+    def generate_pixel_positions(self, camera_pos: np.ndarray) -> tuple:
+        # fit points to canvas
+        x, y = camera_pos[:, 0]/camera_pos[:, 3], camera_pos[:, 1]/camera_pos[:, 3]
+        px = (x * self.scale + self.width/2).astype(np.int32)
+        py = (-1 * y * self.scale + self.height/2).astype(np.int32)
+
+        depth = camera_pos[:, 2]
+        self.depth_manager.add_depth(depth)
+
+        return px, py, depth
+
+    def draw_triangles(self, positions: tuple, indices: np.ndarray, varyings: dict, material: PBRMaterial, depth_only: bool = False) -> None:
+        px, py, depth = self.gather_triangles(positions, indices)
+        corners = np.asarray(indices).reshape(-1, 3)
+        if self.occlusion and len(corners):
+            with self.timer.stage("cull"):
+                # triangles whose nearest corner is behind the depth pyramid are never filled
+                hidden = self.depth_manager.occluded(
+                    np.clip(px.min(axis=1), 0, self.width - 1), np.clip(py.min(axis=1), 0, self.height - 1),
+                    np.clip(px.max(axis=1), 0, self.width - 1), np.clip(py.max(axis=1), 0, self.height - 1),
+                    depth.max(axis=1))
+                visible = ~hidden
+                px, py, depth, corners = px[visible], py[visible], depth[visible], corners[visible]
+            self.timer.count("occluded", hidden.sum())
+        # (T, 3, k) corner values of every varying
+        values = {name: np.asarray(v)[corners] for name, v in varyings.items()}
+        # depth is the view z and w = -z, so this is 1/w of every corner
+        inverse_w = -1.0 / depth
+        if self.deferred and not depth_only:
+            # world positions come back from the depth buffer when the G-buffer is resolved; double sided
+            # surfaces still need them here, their normals are faced now, as rebuilt positions can end up
+            # on the other side of a silhouette
+            shader = self.gbuffer.get_shader(material, sorted(values))
+            if not (material.double_sided and "normal" in values):
+                values.pop("world", None)
+        for tris, xs, ys, weights in self.fill_triangles(px, py):
+            with self.timer.stage("depth"):
+                weights = self.perspective_weights(weights, inverse_w[tris])
+                depths = (weights * depth[tris]).sum(axis=1)
+                if self.depth_equal:
+                    passed = self.depth_manager.equal_pixels(xs, ys, depths)
                 else:
-                    self.draw_triangles(positions, indices, color)
-
-        return Image.fromarray(self.color_map, 'RGB')
-
-    def generate_pixel_positions(self, positions: list) -> list:
-        pixel_positions = list()
-        projection_matrix = self.camera.get_perspective().transpose()
-        for pos in positions:
-            pos.append(1)   # [x, y, z] -> [x, y, z, 1]
-            camera_pos = np.matmul(pos, projection_matrix)   # [x', y', z', -z']
-
-            # fit points to canvas
-            x, y = camera_pos[0]/camera_pos[3], camera_pos[1]/camera_pos[3]
-            px = (int)(x * self.scale + self.width/2)
-            py = (int)(-1 * y * self.scale + self.height/2)
-
-            depth = camera_pos[2]
-            pixel_positions.append(Vertice(px, py, depth))
-            self.depth_manager.add_depth(depth)
-
-        return pixel_positions
-
-    def draw_triangles(self, positions: list, indices: list, color) -> None:
-        for i in range(0, len(indices), 3):
-            a = positions[indices[i]]
-            b = positions[indices[i + 1]]
-            c = positions[indices[i + 2]]
-            # self.draw_triangle_outline(Triangle(a, b, c))
-            self.draw_triangle(Triangle(a, b, c), color)
-
-    def draw_triangle(self, triangle: Triangle, color) -> None:
-        # use barycentric coordinates
-        step = 1.0/triangle.max_edge
-        for p in np.arange(0, 1, step):
-            # handle boundary
-            self.draw_triangle_pixel(triangle, p, 1 - p, color)
-            for q in np.arange(0, 1 - p, step):
-                self.draw_triangle_pixel(triangle, p, q, color)
-
-    def draw_triangle_pixel(self, triangle: Triangle, p: float, q: float, color) -> None:
-        point = triangle.get_vertice(p, q)
-        if self.depth_manager.override(point):
-            # color = self.depth_manager.get_color(point)
-            self.draw_pixel(point.x, point.y, color)
-
-    def draw_triangles_with_texture(self, positions: list, indices: list, uvs: list, texture: Image) -> None:
-        width, height = texture.size
-        for i in range(0, len(indices), 3):
-            a = positions[indices[i]]
-            b = positions[indices[i + 1]]
-            c = positions[indices[i + 2]]
-
-            auv = uvs[indices[i]]
-            buv = uvs[indices[i + 1]]
-            cuv = uvs[indices[i + 2]]
-            # self.draw_triangle_outline(Triangle(a, b, c))
-            x = self.to_uv_vertice(auv, width, height)
-            y = self.to_uv_vertice(buv, width, height)
-            z = self.to_uv_vertice(cuv, width, height)
-
-            self.draw_triangle_with_texture(Triangle(a, b, c), Triangle(x, y, z), texture)
-
-    def to_uv_vertice(self, uv, width, height) -> Vertice:
-        x = int(uv[0] * width)
-        if x >= width:
-            x = width - 1
-        y = int(uv[1] * height)
-        if y >= height:
-            y = height - 1
-        return Vertice(x, y, 0)
-
-    def draw_triangle_with_texture(self, triangle: Triangle, uvTriangle: Triangle, texture: Image) -> None:
-        # use barycentric coordinates
-        step = 1.0/triangle.max_edge
-        for p in np.arange(0, 1, step):
-            # handle boundary
-            self.draw_triangle_pixel_with_texture(triangle, uvTriangle, p, 1 - p, texture)
-            for q in np.arange(0, 1 - p, step):
-                self.draw_triangle_pixel_with_texture(triangle, uvTriangle, p, q, texture)
-
-    def draw_triangle_pixel_with_texture(self, triangle: Triangle, uvTriagnle: Triangle, p: float, q: float, texture: Image) -> None:
-        point = triangle.get_vertice(p, q)
-        if self.depth_manager.override(point):
-            # color = self.depth_manager.get_color(point)
-            uvpoint = uvTriagnle.get_vertice(p, q)
-            px = texture.load()
-            self.draw_pixel(point.x, point.y, px[uvpoint.x, uvpoint.y])
+                    passed = self.depth_manager.override_pixels(xs, ys, depths)
+            if depth_only:
+                continue
+
+            # interpolate the varyings only for the pixels that survived the depth test
+            tris, weights, xs, ys = tris[passed], weights[passed], xs[passed], ys[passed]
+            self.timer.count("written", len(tris))
+            if self.deferred:
+                with self.timer.stage("gbuffer"):
+                    fragments = {name: self.interpolate(weights, v[tris]) for name, v in values.items()}
+                    if "world" in fragments:
+                        fragments["normal"] = self.face_normals(fragments["normal"], fragments.pop("world"))
+                    self.gbuffer.write(xs, ys, shader, fragments)
+                continue
+
+            with self.timer.stage("shade"):
+                samples = None
+                if self.antialias == AA_MSAA:
+                    tris, weights, samples = self.pixel_fragments(tris, xs, ys, weights)
+                fragments = {name: self.interpolate(weights, v[tris]) for name, v in values.items()}
+                # colors = self.depth_manager.get_color(depths[passed])
+                colors = self.shade(material, fragments, len(tris))
+                self.color_map[ys, xs] = colors if samples is None else colors[samples]
+                self.timer.count("shaded", len(tris))
+
+    def pixel_fragments(self, tris: np.ndarray, xs: np.ndarray, ys: np.ndarray, weights: np.ndarray) -> tuple:
+        # MSAA: the samples a triangle covers in one pixel become one fragment at their centroid,
+        # which lies inside the triangle; returns its triangle and weights, and the fragment of every sample
+        factor = self.factor
+        columns, rows = -(-self.width // factor), -(-self.height // factor)
+        keys = (tris.astype(np.int64) * rows + ys // factor) * columns + xs // factor
+        _, first, samples = np.unique(keys, return_index=True, return_inverse=True)
+        samples = samples.ravel()
+        counts = np.bincount(samples)
+        centroids = np.stack([np.bincount(samples, weights[:, k]) for k in range(3)], axis=1) / counts[:, None]
+        return tris[first], centroids, samples
+
+    def interpolate(self, weights: np.ndarray, corners: np.ndarray) -> np.ndarray:
+        # (N, k) values at the fragments from their (N, 3) weights and (N, 3, k) corner values
+        return np.einsum("nc,nck->nk", weights, corners)
+
+    def perspective_weights(self, weights: np.ndarray, inverse_w: np.ndarray) -> np.ndarray:
+        # screen space barycentric weights to perspective correct ones,
+        # an attribute divided by w is what varies linearly over the screen
+        weights = weights * inverse_w
+        return weights / weights.sum(axis=1, keepdims=True)
+
+    def face_normals(self, normals: np.ndarray, world: np.ndarray) -> np.ndarray:
+        # the back of a double sided surface is lit from its own side
+        eye = np.asarray(self.camera.position, np.float64)
+        facing = ((eye - world) * normals).sum(axis=1) < 0
+        normals[facing] *= -1
+        return normals
+
+    def shade(self, material: PBRMaterial, fragments: dict, count: int, faced: bool = False) -> np.ndarray:
+        # (N, 3) uint8 colors from the interpolated varyings of N fragments; faced when the normals
+        # of double sided surfaces were already turned to the eye, as the G-buffer stores them
+        if "uv" in fragments:
+            colors = material.texture.sample(fragments["uv"])
+        else:
+            colors = np.broadcast_to(np.asarray(material.color, np.uint8), (count, 3))
+        if "color" in fragments:
+            colors = (colors * np.clip(fragments["color"], 0, 1) + 0.5).astype(np.uint8)
+        if "normal" not in fragments:
+            return colors
+
+        albedo, world = to_linear(colors), fragments["world"]
+        eye = np.asarray(self.camera.position, np.float64)
+        normals = normalize(fragments["normal"])
+        if material.double_sided and not faced:
+            normals = self.face_normals(normals, world)
+        if self.shading == LAMBERT:
+            lit = shade_lambert(albedo, normals, world, self.lights, self.ambient)
+        elif self.shading == BLINN_PHONG:
+            lit = shade_blinn_phong(albedo, normals, world, eye, self.lights, self.ambient, material.metallic, material.roughness)
+        else:
+            lit = shade_pbr(albedo, normals, world, eye, self.lights, self.ambient, material.metallic, material.roughness)
+        return to_srgb(lit)
+
+    def gather_triangles(self, positions: tuple, indices: np.ndarray) -> tuple:
+        # (T, 3) arrays of the pixel x, pixel y and depth of every triangle corner
+        corners = np.asarray(indices).reshape(-1, 3)
+        px, py, depth = positions
+        return px[corners], py[corners], depth[corners]
+
+    def fill_triangles(self, px: np.ndarray, py: np.ndarray):
+        # the fill engine picked by self.fill, both yield the same fragments
+        if self.fill == FILL_SCANLINE:
+            return self.scan_triangles(px, py)
+        return self.cover_triangles(px, py)
+
+    def edge_functions(self, px: np.ndarray, py: np.ndarray) -> tuple:
+        # edge function opposite each corner: e(x, y) = ex * x + ey * y + ek,
+        # stored as (3, T) so every edge is evaluated on flat arrays
+        x, y = px.T.astype(np.float64), py.T.astype(np.float64)
+        ex = np.roll(y, -1, axis=0) - np.roll(y, 1, axis=0)
+        ey = np.roll(x, 1, axis=0) - np.roll(x, -1, axis=0)
+        ek = np.roll(x, -1, axis=0) * np.roll(y, 1, axis=0) - np.roll(x, 1, axis=0) * np.roll(y, -1, axis=0)
+        area = ek.sum(axis=0)
+        # orient the edges so covered pixels are positive for both windings
+        sign = np.sign(area)
+        return ex * sign, ey * sign, ek * sign, np.abs(area)
+
+    def expand_spans(self, tris: np.ndarray, ys: np.ndarray, x0: np.ndarray, widths: np.ndarray) -> tuple:
+        # one entry per pixel of every horizontal span (triangle, row, first x, width)
+        tris = np.repeat(tris, widths)
+        ys = np.repeat(ys, widths)
+        xs = np.repeat(x0, widths) + np.arange(len(tris)) - np.repeat(np.cumsum(widths) - widths, widths)
+        return tris, xs, ys
+
+    def split_chunks(self, counts: np.ndarray) -> list:
+        # split the items so no chunk holds much more than CHUNK_PIXELS pixels
+        ends = np.cumsum(counts)
+        splits = np.searchsorted(ends, np.arange(CHUNK_PIXELS, ends[-1] if len(ends) else 0, CHUNK_PIXELS))
+        return np.split(np.arange(len(counts)), np.unique(splits))
+
+    def cover_triangles(self, px: np.ndarray, py: np.ndarray):
+        # evaluate the three edge functions of every triangle over its bounding box,
+        # yield (triangle, x, y, barycentric weights) of the covered pixels in chunks
+        with self.timer.stage("rasterize"):
+            x0 = np.maximum(px.min(axis=1), 0)
+            x1 = np.minimum(px.max(axis=1), self.width - 1)
+            y0 = np.maximum(py.min(axis=1), 0)
+            y1 = np.minimum(py.max(axis=1), self.height - 1)
+            ex, ey, ek, area = self.edge_functions(px, py)
+
+            visible = np.nonzero((x0 <= x1) & (y0 <= y1) & (area > 0))[0]
+            widths = (x1 - x0 + 1)[visible]
+            heights = (y1 - y0 + 1)[visible]
+            chunks = self.split_chunks(widths * heights)
+
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            with self.timer.stage("rasterize"):
+                # one entry per bounding box row, then one entry per pixel of each row
+                rows = np.repeat(chunk, heights[chunk])
+                row_y = np.arange(len(rows)) - np.repeat(np.cumsum(heights[chunk]) - heights[chunk], heights[chunk])
+                tris = visible[rows]
+                tris, xs, ys = self.expand_spans(tris, y0[tris] + row_y, x0[tris], widths[rows])
+
+                e0 = ex[0][tris] * xs + ey[0][tris] * ys + ek[0][tris]
+                e1 = ex[1][tris] * xs + ey[1][tris] * ys + ek[1][tris]
+                e2 = area[tris] - e0 - e1
+                inside = (e0 >= 0) & (e1 >= 0) & (e2 >= 0)
+
+                tris = tris[inside]
+                weights = np.stack([e0[inside], e1[inside], e2[inside]], axis=1) / area[tris, None]
+            self.timer.count("fragments", len(tris))
+            yield tris, xs[inside], ys[inside], weights
+
+    def scan_triangles(self, px: np.ndarray, py: np.ndarray):
+        # classic scanline fill: sort the corners by y, step the long edge and the two short
+        # edges down the rows in 16.16 fixed point, and only visit the pixels of each span
+        with self.timer.stage("rasterize"):
+            ex, ey, ek, area = self.edge_functions(px, py)
+            order = np.argsort(py, axis=1, kind="stable")
+            x = np.take_along_axis(px, order, axis=1).astype(np.int64)
+            y = np.take_along_axis(py, order, axis=1).astype(np.int64)
+
+            top = np.maximum(y[:, 0], 0)
+            bottom = np.minimum(y[:, 2], self.height - 1)
+            visible = np.nonzero((top <= bottom) & (area > 0)
+                & (px.max(axis=1) >= 0) & (px.min(axis=1) < self.width))[0]
+            heights = (bottom - top + 1)[visible]
+            chunks = self.split_chunks(heights * (np.ptp(px[visible], axis=1) + 1))
+
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            with self.timer.stage("rasterize"):
+                rows = np.repeat(chunk, heights[chunk])
+                tris = visible[rows]
+                row_y = top[tris] + np.arange(len(rows)) - np.repeat(np.cumsum(heights[chunk]) - heights[chunk], heights[chunk])
+
+                # long edge from corner 0 to 2, short edge 0 to 1 above corner 1 and 1 to 2 below it
+                long_x = self.step_edge(x[tris, 0], y[tris, 0], x[tris, 2], y[tris, 2], row_y)
+                upper = row_y < y[tris, 1]
+                a = np.where(upper, 0, 1)
+                short_x = self.step_edge(x[tris, a], y[tris, a], x[tris, a + 1], y[tris, a + 1], row_y)
+
+                # span between both edges, rounded inwards to whole pixels
+                left = (np.minimum(long_x, short_x) + 0xFFFF) >> 16
+                right = np.maximum(long_x, short_x) >> 16
+                left = np.maximum(left, 0)
+                right = np.minimum(right, self.width - 1)
+                widths = np.maximum(right - left + 1, 0)
+                tris, xs, ys = self.expand_spans(tris, row_y, left, widths)
+
+                e0 = ex[0][tris] * xs + ey[0][tris] * ys + ek[0][tris]
+                e1 = ex[1][tris] * xs + ey[1][tris] * ys + ek[1][tris]
+                weights = np.stack([e0, e1, area[tris] - e0 - e1], axis=1) / area[tris, None]
+            self.timer.count("fragments", len(tris))
+            yield tris, xs, ys, weights
+
+    def step_edge(self, xa: np.ndarray, ya: np.ndarray, xb: np.ndarray, yb: np.ndarray, row_y: np.ndarray) -> np.ndarray:
+        # 16.16 fixed point x of an edge on a row, the start plus one slope step per row below it,
+        # with the remainder of the steps carried like a DDA so long edges don't drift;
+        # a flat bottom edge is only met on its own row, where the long edge already reaches its end
+        dy = yb - ya
+        steps = ((xb - xa) * (row_y - ya) << 16) // np.maximum(dy, 1)
+        return np.where(dy > 0, (xa << 16) + steps, xa << 16)
 
     def draw_triangle_outline(self, triangle: Triangle) -> None:
         color_white = (255, 255, 255)
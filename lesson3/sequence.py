@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageFile
+from animation import Animation
+from camera import Camera
+from lighting import UNLIT, LAMBERT, BLINN_PHONG, PBR
+from mesh_cache import MeshCache
+from rasterizer import Rasterizer
+
+I_WIDTH = 800
+I_HEIGHT = 600
+I_SCALE = 200
+
+# frames waiting to be encoded at most, rendering blocks beyond that so memory stays flat
+PENDING_FRAMES = 4
+ENCODE_WORKERS = 2
+
+def orbit_path(frames: int, radius: float = 3.7, height: float = 2, look_at: list = [0, 0, 0], fovy: float = 45, near: float = 1):
+    # Camera.set arguments of a full turn around look_at, one per frame
+    for frame in range(frames):
+        angle = 2 * np.pi * frame / frames
+        yield {
+            "position": [look_at[0] + radius * np.sin(angle), look_at[1] + height, look_at[2] + radius * np.cos(angle)],
+            "look_at": list(look_at),
+            "up": [0, 1, 0],
+            "fovy": fovy,
+            "near": near,
+        }
+
+def render_frames(rasterizer: Rasterizer, path, animation: Animation = None, step: float = 0.04):
+    # move the camera along the path and yield every frame, the scene is loaded only once;
+    # an animation advances step seconds a frame, looping over its duration
+    for frame, params in enumerate(path):
+        rasterizer.camera.set(**params)
+        if animation != None:
+            animation.apply(frame * step % animation.duration if animation.duration else 0)
+        yield rasterizer.draw_primitives()
+
+class SpooledFrames(ImageFile.ImageFile):
+    # frames of one size stored back to back as raw RGB in a file, a multi-frame image that
+    # loads one frame per seek, so Pillow's save(save_all=True) never holds them all
+    format = "SPOOL"
+    format_description = "spooled RGB frames"
+
+    def __init__(self, spool, size: tuple, count: int) -> None:
+        self.spool = spool
+        self.frame_size = size
+        self.n_frames = count
+        super().__init__(spool)
+
+    def _open(self) -> None:
+        self._mode = "RGB"
+        self._size = self.frame_size
+        self.is_animated = self.n_frames > 1
+        self.seek(0)
+
+    def seek(self, frame: int) -> None:
+        if frame < 0 or frame >= self.n_frames:
+            raise EOFError("no frame %d of %d" % (frame, self.n_frames))
+        self.frame = frame
+        width, height = self.size
+        # loading a frame lets go of the file, every seek hands it back to the decoder
+        self.fp = self.spool
+        self.tile = [("raw", (0, 0, width, height), frame * width * height * 3, ("RGB", 0, 1))]
+
+    def tell(self) -> int:
+        return self.frame
+
+class FrameWriter:
+    # encodes frames on background threads while the next ones render; output is either
+    # a pattern like "out/frame_%04d.png" for an image sequence, or one animated .webp file
+    def __init__(self, output: str, duration: int = 40, workers: int = ENCODE_WORKERS, pending: int = PENDING_FRAMES) -> None:
+        self.output = output
+        self.duration = duration
+        self.pending = pending
+        self.futures = deque()
+        self.count = 0
+        self.animated = "%" not in output
+        if self.animated and not output.lower().endswith(".webp"):
+            raise ValueError("an animation is written as .webp, use a pattern like frame_%04d.png for a sequence")
+
+        folder = os.path.dirname(output)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # frames of an animation are spooled to one file in order, so they get a single thread
+        self.executor = ThreadPoolExecutor(1 if self.animated else workers)
+        self.spool = tempfile.TemporaryFile() if self.animated else None
+        self.size = None
+
+    def write(self, image: Image) -> None:
+        # wait for the oldest frame when too many are queued, this also raises its errors
+        while len(self.futures) >= self.pending:
+            self.futures.popleft().result()
+        if self.animated:
+            self.futures.append(self.executor.submit(self.add_frame, image))
+        else:
+            self.futures.append(self.executor.submit(image.save, self.output % self.count))
+        self.count += 1
+
+    def add_frame(self, image: Image) -> None:
+        # Pillow encodes an animation from frames it can seek through, they go to disk
+        # as they render and are read back one at a time when the file is saved
+        if self.size == None:
+            self.size = image.size
+        if image.size != self.size:
+            raise ValueError("frame of %dx%d in an animation of %dx%d" % (image.size + self.size))
+        self.spool.write(image.convert("RGB").tobytes())
+
+    def close(self) -> int:
+        # finish every queued frame, write the animation and return the frame count
+        try:
+            while self.futures:
+                self.futures.popleft().result()
+            if self.animated and self.size != None:
+                self.spool.flush()
+                frames = SpooledFrames(self.spool, self.size, self.count)
+                frames.save(self.output, save_all=True, duration=self.duration, loop=0, lossless=False, quality=80, method=0)
+        finally:
+            self.executor.shutdown()
+            if self.spool != None:
+                self.spool.close()
+                self.spool = None
+        return self.count
+
+def render_sequence(rasterizer: Rasterizer, path, output: str, duration: int = 40, workers: int = ENCODE_WORKERS, animation: Animation = None) -> int:
+    writer = FrameWriter(output, duration, workers)
+    try:
+        for image in render_frames(rasterizer, path, animation, duration / 1000):
+            writer.write(image)
+    finally:
+        count = writer.close()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="render a turntable or a camera path to an image sequence or an animated webp")
+    parser.add_argument("file")
+    parser.add_argument("output", help="pattern like frames/frame_%%04d.png, or a .webp file for an animation")
+    parser.add_argument("--frames", type=int, default=36, help="frames of the orbit")
+    parser.add_argument("--radius", type=float, default=3.7)
+    parser.add_argument("--height", type=float, default=2)
+    parser.add_argument("--path", help="json list of Camera.set arguments to use instead of an orbit")
+    parser.add_argument("--duration", type=int, default=40, help="milliseconds per frame of an animation")
+    parser.add_argument("--size", default="%dx%d" % (I_WIDTH, I_HEIGHT))
+    parser.add_argument("--scale", type=int, default=I_SCALE)
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS, help="encoding threads of an image sequence")
+    parser.add_argument("--cache", action="store_true", help="load through the on-disk mesh cache")
+    parser.add_argument("--shading", default=UNLIT, choices=[UNLIT, LAMBERT, BLINN_PHONG, PBR])
+    parser.add_argument("--deferred", action="store_true", help="shade each visible pixel once from a G-buffer")
+    parser.add_argument("--lod", action="store_true", help="draw small and far away meshes with fewer triangles")
+    parser.add_argument("--animation", help="name or index of a glTF animation to play, in real time at the frame duration")
+    args = parser.parse_args()
+
+    if args.path:
+        with open(args.path) as f:
+            path = json.load(f)
+    else:
+        path = orbit_path(args.frames, args.radius, args.height)
+
+    width, height = (int(v) for v in args.size.split("x"))
+    camera = Camera()
+    # levels of detail are built with the model, and kept in the cache entry
+    rasterizer = Rasterizer(width, height, args.scale, camera, args.file, MeshCache(lod=args.lod) if args.cache else None, args.lod)
+    rasterizer.shading = args.shading
+    rasterizer.deferred = args.deferred
+    animation = None
+    if args.animation != None:
+        names = [a.name for a in rasterizer.animations]
+        if args.animation in names:
+            animation = rasterizer.animations[names.index(args.animation)]
+        elif args.animation.isdigit() and int(args.animation) < len(names):
+            animation = rasterizer.animations[int(args.animation)]
+        else:
+            parser.error("no animation %s, the model has %s" % (args.animation, names or "none"))
+    count = render_sequence(rasterizer, path, args.output, args.duration, args.workers, animation)
+    print("wrote", count, "frames to", args.output)
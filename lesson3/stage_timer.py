@@ -0,0 +1,36 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class StageTimer:
+    # wall time, calls and peak memory of every pipeline stage in a frame,
+    # memory is only measured while tracemalloc is tracing
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {"time": 0.0, "calls": 0, "peak_memory": 0})
+            stage["time"] += elapsed
+            stage["calls"] += 1
+            if tracing:
+                stage["peak_memory"] = max(stage["peak_memory"], tracemalloc.get_traced_memory()[1] - base)
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def report(self) -> dict:
+        return {"stages": {k: dict(v) for k, v in self.stages.items()}, "counters": dict(self.counters)}
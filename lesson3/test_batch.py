@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from batch import AssetCache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class AssetCacheTest(unittest.TestCase):
+    # a warm worker must see a changed buffer or image even when the .gltf itself is untouched
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp()
+        for name in ("shapes.gltf", "shapes.bin", "Image_0.jpg"):
+            shutil.copy(os.path.join(HERE, name), self.folder)
+        self.model = os.path.join(self.folder, "shapes.gltf")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.folder)
+
+    def replace(self, name: str, data: bytes) -> None:
+        # written next to the file and renamed over it, like an exporter would,
+        # so arrays still mapped from the old file keep their bytes
+        path = os.path.join(self.folder, name)
+        with open(path + ".new", "wb") as f:
+            f.write(data)
+        os.replace(path + ".new", path)
+
+    def texels(self, meshes: list) -> list:
+        return [np.array(p.material.texture.texels) for m in meshes for p in m.primitives if p.material.texture != None]
+
+    def test_unchanged_model_is_reused(self) -> None:
+        assets = AssetCache()
+        first = assets.load(self.model)
+        self.assertIs(assets.load(self.model), first)
+        self.assertEqual(assets.hits, 1)
+
+    def test_changed_image_reloads(self) -> None:
+        assets = AssetCache()
+        before = self.texels(assets.load(self.model))
+        image = os.path.join(self.folder, "Image_0.jpg")
+        inverted = os.path.join(self.folder, "inverted.jpg")
+        Image.fromarray(255 - np.asarray(Image.open(image))).save(inverted)
+        with open(inverted, "rb") as f:
+            self.replace("Image_0.jpg", f.read())
+
+        after = self.texels(assets.load(self.model))
+        self.assertEqual(assets.hits, 0)
+        self.assertFalse(all(np.array_equal(a, b) for a, b in zip(before, after)))
+
+    def test_changed_buffer_reloads(self) -> None:
+        assets = AssetCache()
+        before = [np.array(p.vertices) for m in assets.load(self.model) for p in m.primitives]
+        with open(os.path.join(self.folder, "shapes.bin"), "rb") as f:
+            data = bytearray(f.read())
+        # the float32 at the start of every 16 bytes is moved, some of them are positions
+        values = np.frombuffer(data, np.float32).copy()
+        values[::4] += 1
+        self.replace("shapes.bin", values.tobytes() + bytes(data[values.nbytes:]))
+
+        after = [np.array(p.vertices) for m in assets.load(self.model) for p in m.primitives]
+        self.assertEqual(assets.hits, 0)
+        self.assertFalse(all(np.array_equal(a, b) for a, b in zip(before, after)))
+
+if __name__ == "__main__":
+    unittest.main()
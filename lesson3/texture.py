@@ -0,0 +1,96 @@
+import io
+import os
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+# glTF sampler constants
+NEAREST = 9728
+LINEAR = 9729
+CLAMP_TO_EDGE = 33071
+MIRRORED_REPEAT = 33648
+REPEAT = 10497
+
+# decoded texels kept in memory by default
+CACHE_BUDGET = 256 * 1024 * 1024
+
+class TextureCache:
+    # decoded images keyed by uri, least recently used ones are dropped over budget;
+    # images embedded in a model come with a function returning their encoded bytes,
+    # under a "model path#image{i}" uri
+    def __init__(self, budget: int = CACHE_BUDGET) -> None:
+        self.budget = budget
+        self.size = 0
+        # uri -> (mtime and size of the file it was read from, texels)
+        self.entries = OrderedDict()
+
+    def get(self, uri: str, read_bytes=None) -> np.ndarray:
+        key = os.path.abspath(uri)
+        # an image is decoded again once its file, or the model embedding it, changed
+        stat = os.stat(key if read_bytes == None else key.rsplit("#", 1)[0])
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if key in self.entries:
+            if self.entries[key][0] == stamp:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+            self.size -= self.entries.pop(key)[1].nbytes
+
+        texels = self.decode(key if read_bytes == None else io.BytesIO(read_bytes()))
+        self.entries[key] = (stamp, texels)
+        self.size += texels.nbytes
+        while self.size > self.budget and len(self.entries) > 1:
+            _, (_, old) = self.entries.popitem(last=False)
+            self.size -= old.nbytes
+        return texels
+
+    def decode(self, file) -> np.ndarray:
+        # (height, width, 3) uint8, shared by every user so it's read only
+        with Image.open(file) as image:
+            texels = np.ascontiguousarray(np.asarray(image.convert('RGB')))
+        texels.flags.writeable = False
+        return texels
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+# one cache for every loader and rasterizer in the process
+texture_cache = TextureCache()
+
+class Texture:
+    def __init__(self, texels: np.ndarray, mag_filter: int = None, wrap_s: int = REPEAT, wrap_t: int = REPEAT) -> None:
+        self.texels = texels
+        self.height, self.width = texels.shape[:2]
+        self.mag_filter = mag_filter
+        self.bilinear = mag_filter == LINEAR
+        self.wrap_s = wrap_s
+        self.wrap_t = wrap_t
+
+    def sample(self, uvs: np.ndarray) -> np.ndarray:
+        # colors of a whole batch of (N, 2) uvs, returned as (N, 3) uint8
+        x = uvs[:, 0] * self.width
+        y = uvs[:, 1] * self.height
+        if not self.bilinear:
+            u = self.wrap(np.floor(x).astype(np.int64), self.width, self.wrap_s)
+            v = self.wrap(np.floor(y).astype(np.int64), self.height, self.wrap_t)
+            return self.texels[v, u]
+
+        # blend the four texels around the sample, texel centers sit at +0.5
+        x, y = x - 0.5, y - 0.5
+        x0, y0 = np.floor(x), np.floor(y)
+        fx, fy = (x - x0)[:, None], (y - y0)[:, None]
+        u0 = self.wrap(x0.astype(np.int64), self.width, self.wrap_s)
+        u1 = self.wrap(x0.astype(np.int64) + 1, self.width, self.wrap_s)
+        v0 = self.wrap(y0.astype(np.int64), self.height, self.wrap_t)
+        v1 = self.wrap(y0.astype(np.int64) + 1, self.height, self.wrap_t)
+        top = self.texels[v0, u0] * (1 - fx) + self.texels[v0, u1] * fx
+        bottom = self.texels[v1, u0] * (1 - fx) + self.texels[v1, u1] * fx
+        return (top * (1 - fy) + bottom * fy + 0.5).astype(np.uint8)
+
+    def wrap(self, i: np.ndarray, size: int, mode: int) -> np.ndarray:
+        if mode == CLAMP_TO_EDGE:
+            return np.clip(i, 0, size - 1)
+        if mode == MIRRORED_REPEAT:
+            i = i % (2 * size)
+            return np.where(i < size, i, 2 * size - 1 - i)
+        return i % size
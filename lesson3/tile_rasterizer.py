@@ -0,0 +1,193 @@
+import copy
+import weakref
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+from camera import Camera
+from depth_manager import DepthManager
+from gbuffer import GBuffer
+from mesh_cache import MeshCache
+from rasterizer import Rasterizer, AA_SAMPLES
+from stage_timer import StageTimer
+from triangle import PBRMaterial
+
+TILE_SIZE = 64
+
+# shared frame buffers and textures, set once in every worker process
+worker_state = {}
+
+class Tile(Rasterizer):
+    # a rectangle of the shared frame buffers, drawn like a small canvas
+    def __init__(self, x: int, y: int, color_map: np.ndarray, depth_map: np.ndarray, settings: dict) -> None:
+        self.x = x
+        self.y = y
+        # fill, shading, lights, camera and passes of the frame
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.height, self.width = depth_map.shape
+        self.color_map = color_map
+        self.depth_manager = DepthManager(self.width, self.height)
+        self.depth_manager.depth_map = depth_map
+        # deferred tiles resolve their own G-buffer, so it only needs to cover the tile
+        self.gbuffer = GBuffer(self.width, self.height) if self.deferred else None
+        self.timer = StageTimer()
+
+    def unproject(self, xs: np.ndarray, ys: np.ndarray, depths: np.ndarray) -> np.ndarray:
+        # tile pixels moved to where they are in the frame, relative to the center of the tile
+        width, height = self.frame_size
+        return super().unproject(xs + self.x - (width - self.width) / 2, ys + self.y - (height - self.height) / 2, depths)
+
+def free_buffers(*buffers: shared_memory.SharedMemory) -> None:
+    for buffer in buffers:
+        buffer.close()
+        buffer.unlink()
+
+def init_worker(color_name: str, depth_name: str, width: int, height: int, textures: list) -> None:
+    color = shared_memory.SharedMemory(name=color_name)
+    depth = shared_memory.SharedMemory(name=depth_name)
+    worker_state["buffers"] = (color, depth)
+    worker_state["color_map"] = np.ndarray((height, width, 3), np.uint8, color.buf)
+    worker_state["depth_map"] = np.ndarray((height, width), np.float32, depth.buf)
+    worker_state["textures"] = textures
+
+def draw_tile(job: tuple) -> None:
+    x, y, width, height, settings, draws = job
+    tile = Tile(x, y,
+        worker_state["color_map"][y:y + height, x:x + width],
+        worker_state["depth_map"][y:y + height, x:x + width], settings)
+
+    # move the triangles into tile space, the edge functions don't change
+    draws = [((px - x, py - y, depth), np.arange(len(px)), varyings, material, texture) for px, py, depth, varyings, material, texture in draws]
+    if tile.depth_prepass:
+        for positions, indices, _, _, _ in draws:
+            tile.draw_triangles(positions, indices, {}, None, depth_only=True)
+        tile.depth_equal = True
+    for positions, indices, varyings, material, texture in draws:
+        material.texture = None if texture == None else worker_state["textures"][texture]
+        tile.draw_triangles(positions, indices, varyings, material)
+    if tile.deferred:
+        tile.resolve()
+
+class TileRasterizer(Rasterizer):
+    def __init__(self, width: int, height: int, scale: int, camera: Camera, file: str, cache: MeshCache = None, lod: bool = False,
+            tile_size: int = TILE_SIZE, workers: int = None) -> None:
+        super().__init__(width, height, scale, camera, file, cache, lod)
+        self.tile_size = tile_size
+        self.workers = workers
+        # started by the first frame and kept until close, later frames reuse the workers
+        self.executor = None
+        self.finalizer = None
+        self.share_buffers()
+
+        # textures are sent to every worker once, draws refer to them by index
+        self.textures = []
+        for mesh in self.meshes:
+            for primitive in mesh.primitives:
+                texture = primitive.material.texture
+                if texture != None and not any(texture is t for t in self.textures):
+                    self.textures.append(texture)
+
+    def share_buffers(self) -> None:
+        # move both frame buffers into shared memory, so workers write them in place
+        self.color_buffer = shared_memory.SharedMemory(create=True, size=self.color_map.nbytes)
+        self.depth_buffer = shared_memory.SharedMemory(create=True, size=self.depth_manager.depth_map.nbytes)
+        color_map = np.ndarray(self.color_map.shape, np.uint8, self.color_buffer.buf)
+        depth_map = np.ndarray(self.depth_manager.depth_map.shape, np.float32, self.depth_buffer.buf)
+        color_map[:] = self.color_map
+        depth_map[:] = self.depth_manager.depth_map
+        self.color_map = color_map
+        self.depth_manager.depth_map = depth_map
+        # the segments outlive the process unless unlinked, so they go with the rasterizer
+        # even when close is never called
+        self.finalizer = weakref.finalize(self, free_buffers, self.color_buffer, self.depth_buffer)
+
+    def __enter__(self) -> "TileRasterizer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def set_antialias(self, mode: str, samples: int = AA_SAMPLES) -> None:
+        # the sample grid gets new shared buffers and workers, and tiles keep whole pixels
+        self.close()
+        super().set_antialias(mode, samples)
+        self.tile_size = -(-self.tile_size // self.factor) * self.factor
+        self.share_buffers()
+
+    def close(self) -> None:
+        # stops the workers and frees the shared memory, safe to call more than once
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.finalizer == None or not self.finalizer.alive:
+            return
+        # drop our views before releasing the shared memory
+        self.color_map = self.color_map.copy()
+        self.depth_manager.depth_map = self.depth_manager.depth_map.copy()
+        self.finalizer()
+
+    def draw_primitives(self) -> Image:
+        self.clear()
+        self.culler.reset()
+        self.timer.reset()
+        tiles = {}
+        for primitive, level, group in self.batch_items(self.visible_items()):
+            positions, indices, varyings = self.prepare_primitive(primitive, self.matrices[group], level)
+            self.depth_manager.calc_depth_ratio()
+            self.bin_triangles(tiles, positions, indices, varyings, primitive.material)
+
+        jobs = []
+        # every tile runs the depth pre-pass and the deferred resolve over its own draws
+        settings = {"fill": self.fill, "shading": self.shading, "lights": self.lights, "ambient": self.ambient, "camera": self.camera,
+            "deferred": self.deferred, "occlusion": self.occlusion, "depth_prepass": self.depth_prepass, "depth_equal": False,
+            "antialias": self.antialias, "factor": self.factor, "scale": self.scale, "frame_size": (self.width, self.height)}
+        for (tx, ty), draws in sorted(tiles.items()):
+            x, y = tx * self.tile_size, ty * self.tile_size
+            width = min(self.tile_size, self.width - x)
+            height = min(self.tile_size, self.height - y)
+            jobs.append((x, y, width, height, settings, draws))
+
+        if self.executor == None:
+            init_args = (self.color_buffer.name, self.depth_buffer.name, self.width, self.height, self.textures)
+            self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=init_args)
+        list(self.executor.map(draw_tile, jobs))
+
+        return Image.fromarray(self.downsample(), 'RGB')
+
+    def bin_triangles(self, tiles: dict, positions: tuple, indices: np.ndarray, varyings: dict, material: PBRMaterial) -> None:
+        # add the triangles of the primitive to every tile their bounding box touches
+        px, py, depth = self.gather_triangles(positions, indices)
+        corners = np.asarray(indices).reshape(-1, 3)
+        values = {name: np.asarray(v)[corners] for name, v in varyings.items()}
+        x0 = np.clip(px.min(axis=1), 0, self.width - 1) // self.tile_size
+        x1 = np.clip(px.max(axis=1), 0, self.width - 1) // self.tile_size
+        y0 = np.clip(py.min(axis=1), 0, self.height - 1) // self.tile_size
+        y1 = np.clip(py.max(axis=1), 0, self.height - 1) // self.tile_size
+
+        # drop the triangles that are completely off screen
+        visible = np.nonzero((px.max(axis=1) >= 0) & (px.min(axis=1) < self.width)
+            & (py.max(axis=1) >= 0) & (py.min(axis=1) < self.height))[0]
+        columns = (x1 - x0 + 1)[visible]
+        counts = columns * (y1 - y0 + 1)[visible]
+
+        # one (tile, triangle) pair per covered tile, grouped by tile
+        tris = np.repeat(visible, counts)
+        local = np.arange(len(tris)) - np.repeat(np.cumsum(counts) - counts, counts)
+        tile_x = x0[tris] + local % columns.repeat(counts)
+        tile_y = y0[tris] + local // columns.repeat(counts)
+        order = np.lexsort((tile_x, tile_y))
+        tris, tile_x, tile_y = tris[order], tile_x[order], tile_y[order]
+        _, starts = np.unique(tile_y * (self.width // self.tile_size + 1) + tile_x, return_index=True)
+
+        # the material goes without its texels, workers already hold every texture
+        texture = None
+        if material.texture != None:
+            texture = next(i for i, t in enumerate(self.textures) if t is material.texture)
+        material = copy.copy(material)
+        material.texture = None
+        for tile_tris, tx, ty in zip(np.split(tris, starts[1:]), tile_x[starts], tile_y[starts]):
+            tile_varyings = {name: v[tile_tris].reshape(-1, v.shape[2]) for name, v in values.items()}
+            draw = (px[tile_tris].ravel(), py[tile_tris].ravel(), depth[tile_tris].ravel(),
+                tile_varyings, material, texture)
+            tiles.setdefault((tx, ty), []).append(draw)
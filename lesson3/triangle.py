@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 class Vertice:
     def __init__(self, x, y, depth=None):
@@ -36,31 +37,128 @@ class Triangle:
         vertice.round()
         return vertice
 
-class Mesh:
+def compose_matrices(translations: np.ndarray, rotations: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    # (M, 4, 4) matrices from (M, 3) translations, (M, 4) [x, y, z, w] quaternions and (M, 3) scales,
+    # scale first, then rotate and translate
+    x, y, z, w = np.asarray(rotations, np.float64).T
+    matrices = np.zeros((len(x), 4, 4))
+    matrices[:, :3, :3] = np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=1),
+        np.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=1),
+        np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=1)
+    ], axis=1) * np.asarray(scales, np.float64)[:, None, :]
+    matrices[:, :3, 3] = translations
+    matrices[:, 3, 3] = 1
+    return matrices
+
+class Node:
+    # a transform in the scene graph, its world matrix is cached until it or a parent moves
     def __init__(self) -> None:
         self.name = ''
-        self.primitives = []
+        self.parent = None
+        self.children = []
         self.translation = [0, 0, 0]
+        # quaternion [x, y, z, w]
+        self.rotation = [0, 0, 0, 1]
         self.scale = [1, 1, 1]
+        # a glTF node gives either a matrix or translation, rotation and scale
+        self.matrix = None
+        # world_matrix is recomputed by get_matrix while dirty; version counts the changes
+        # of the world matrix, so renderers can tell whether a node moved since they last looked
+        self.dirty = True
+        self.world_matrix = None
+        self.version = 0
+
+    def add_child(self, child: 'Node') -> None:
+        child.parent = self
+        self.children.append(child)
+        child.set_dirty()
 
     def set_translation(self, translation) -> None:
         if translation != None:
             self.translation = translation
+            self.set_dirty()
+
+    def set_rotation(self, rotation) -> None:
+        if rotation != None:
+            self.rotation = rotation
+            self.set_dirty()
 
     def set_scale(self, scale) -> None:
         if scale != None:
             self.scale = scale
+            self.set_dirty()
+
+    def set_matrix(self, matrix) -> None:
+        # glTF matrices are column major
+        if matrix != None:
+            self.matrix = np.array(matrix, np.float64).reshape(4, 4).transpose()
+            self.set_dirty()
+
+    def set_dirty(self) -> None:
+        # the world matrix of the node and of everything below it changes
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.dirty = True
+            node.version += 1
+            stack.extend(node.children)
+
+    def get_local_matrix(self) -> np.ndarray:
+        if self.matrix is not None:
+            return self.matrix
+        return compose_matrices([self.translation], [self.rotation], [self.scale])[0]
+
+    def get_matrix(self) -> np.ndarray:
+        # model matrix in world space
+        if self.dirty:
+            local = self.get_local_matrix()
+            self.world_matrix = local if self.parent == None else self.parent.get_matrix() @ local
+            self.dirty = False
+        return self.world_matrix
+
+class Mesh(Node):
+    # a node that draws geometry, nodes instancing the same glTF mesh share its primitives
+    def __init__(self) -> None:
+        super().__init__()
+        self.primitives = []
+        # (M, 4, 4) matrices of instances drawn in one go, relative to the node, or None for one copy
+        self.instances = None
+        # morph target weights and the animation.Skin deforming the primitives, or None
+        self.weights = []
+        self.skin = None
+        # primitives in the current pose and the (weights, joint matrices) they were posed with
+        self.posed = None
+        self.pose = None
+
+    def get_primitives(self) -> list:
+        # what is drawn: the posed copies of a skinned or morphed mesh, else the primitives
+        return self.primitives if self.posed == None else self.posed
 
 class Primitive:
     def __init__(self) -> None:
         self.vertices = []
         self.normals = []
         self.uvs = []
+        self.colors = []
         self.indices = []
+        self.bounds = np.zeros((2, 3))
+        # (N, 4) joint indices and weights of a skinned primitive
+        self.joints = []
+        self.skin_weights = []
+        # (T, N, 3) position and normal offsets of the morph targets
+        self.targets = []
+        self.target_normals = []
+        # coarser index buffers over the same vertices, finest first, None until built
+        self.lods = None
         self.material = PBRMaterial()
 
 class PBRMaterial:
     def __init__(self) -> None:
         self.color = [255, 255, 255]
         self.texture = None
+        self.double_sided = False
+        # glTF metallic-roughness factors, used by the lit shading models
+        self.metallic = 1.0
+        self.roughness = 1.0
     
\ No newline at end of file